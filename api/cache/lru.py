@@ -0,0 +1,62 @@
+"""
+LRU Cache - Cache em Memória com Expiração
+===========================================
+Cache limitado (LRU) e thread-safe, com TTL opcional por item
+
+Data: 2026-02-03
+"""
+
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Cache LRU thread-safe
+
+    Remove o item menos usado ao passar de `maxsize`; com `ttl` (segundos)
+    os itens também expiram após esse tempo.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Retorna valor do cache (ou default se ausente/expirado)"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+
+            value, expires_at = item
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        """Armazena valor, descartando o item mais antigo se cheio"""
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+_MISSING = object()
@@ -0,0 +1,134 @@
+"""
+Semantic Cache - Cache de Respostas por Frase Equivalente
+==========================================================
+Reaproveita a análise NLP de frases equivalentes já vistas no mesmo chat
+(mesmas palavras de conteúdo e mesmos números)
+
+Data: 2026-02-03
+"""
+
+import re
+import time
+import sqlite3
+import threading
+import unicodedata
+from typing import Any, Dict, Optional
+
+import orjson
+
+_RE_NUMBER = re.compile(r'\d+')
+_RE_PUNCT = re.compile(r'[^\w\s]')
+_RE_UNIT_SPACE = re.compile(r'(\d)\s+(?=[a-z])')
+
+# Palavras ignoradas na comparação (não mudam o que foi comido/treinado)
+_STOPWORDS = frozenset({
+    "a", "o", "as", "os", "um", "uma", "de", "da", "do", "das", "dos",
+    "e", "em", "no", "na", "nos", "nas", "com", "pra", "para", "por",
+    "eu", "meu", "minha", "que", "hoje", "agora", "ja"
+})
+
+# Negações: nunca são ignoradas ("não comi arroz" != "comi arroz")
+_NEGATIONS = frozenset({"nao", "nem", "nunca", "sem", "jamais"})
+
+
+def normalize(text: str) -> str:
+    """Minúsculas, sem acentos/pontuação, "500 ml" -> "500ml", espaços normalizados"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = _RE_UNIT_SPACE.sub(r'\1', _RE_PUNCT.sub(' ', text))
+    return " ".join(text.split())
+
+
+def content_words(text: str) -> str:
+    """
+    Conjunto de palavras de conteúdo, ordenado e unido por espaço
+
+    Um acerto exige o mesmo conjunto: "supino inclinado" e "supino
+    declinado" nunca se confundem, só variações de acento, pontuação,
+    ordem e palavras de ligação. Negações sempre contam.
+    """
+    words = set(normalize(text).split())
+    return " ".join(sorted(w for w in words if w not in _STOPWORDS or w in _NEGATIONS))
+
+
+class SemanticCache:
+    """
+    Cache semântico em SQLite, separado por chat
+
+    Um acerto exige o mesmo conjunto de palavras de conteúdo (ver
+    content_words), os mesmos números no texto ("bebi 500ml" nunca
+    reaproveita "bebi 300ml") e idade <= `ttl`. Assim "bebi 500 ml de
+    agua" e "água 500ml bebi" dividem a entrada; "supino inclinado" e
+    "supino declinado" não. Cada chat guarda no máximo
+    `max_rows_per_chat` entradas.
+    """
+
+    def __init__(
+        self,
+        path: str = ":memory:",
+        ttl: float = 24 * 3600,
+        max_rows_per_chat: int = 200
+    ):
+        self.ttl = ttl
+        self.max_rows_per_chat = max_rows_per_chat
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            """CREATE TABLE IF NOT EXISTS semantic_cache_v3 (
+                chat_id INTEGER NOT NULL,
+                words TEXT NOT NULL,
+                numbers TEXT NOT NULL,
+                value BLOB NOT NULL,
+                ts REAL NOT NULL
+            )"""
+        )
+        self._db.execute(
+            "CREATE INDEX IF NOT EXISTS idx_semantic_v3_chat ON semantic_cache_v3 (chat_id, words, numbers, ts)"
+        )
+
+    def get(self, chat_id: int, text: str) -> Optional[Dict[str, Any]]:
+        """
+        Busca resultado de uma frase equivalente
+
+        Args:
+            chat_id: Chat do Telegram (namespace)
+            text: Texto do usuário
+
+        Returns:
+            Valor armazenado mais recente, ou None
+        """
+        words = content_words(text)
+        numbers = ",".join(_RE_NUMBER.findall(text))
+
+        with self._lock:
+            row = self._db.execute(
+                """SELECT value FROM semantic_cache_v3
+                   WHERE chat_id = ? AND words = ? AND numbers = ? AND ts >= ?
+                   ORDER BY ts DESC LIMIT 1""",
+                (chat_id, words, numbers, time.time() - self.ttl)
+            ).fetchone()
+
+        return orjson.loads(row[0]) if row is not None else None
+
+    def set(self, chat_id: int, text: str, value: Dict[str, Any]) -> None:
+        """Armazena resultado da análise do texto"""
+        words = content_words(text)
+        numbers = ",".join(_RE_NUMBER.findall(text))
+
+        with self._lock:
+            self._db.execute(
+                "DELETE FROM semantic_cache_v3 WHERE ts < ?",
+                (time.time() - self.ttl,)
+            )
+            self._db.execute(
+                "INSERT INTO semantic_cache_v3 (chat_id, words, numbers, value, ts) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, words, numbers, orjson.dumps(value), time.time())
+            )
+            # Manter só as entradas mais recentes do chat
+            self._db.execute(
+                """DELETE FROM semantic_cache_v3 WHERE chat_id = ? AND rowid NOT IN (
+                       SELECT rowid FROM semantic_cache_v3 WHERE chat_id = ?
+                       ORDER BY ts DESC LIMIT ?)""",
+                (chat_id, chat_id, self.max_rows_per_chat)
+            )
+            self._db.commit()
@@ -7,40 +7,53 @@ Data: 2026-02-03
 """
 
 import os
-import json
+import re
+import orjson
 import base64
-import requests
-from typing import Dict, Any, Optional
+import hashlib
+from api.cache.lru import LRUCache
+from api.processors.session import SESSION as _SESSION, warm_connection
+from typing import Dict, Any, List, Optional, Tuple
 from io import BytesIO
 
+# Pillow é opcional: sem ele a imagem segue no tamanho original
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
-GEMINI_VISION_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent"
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+GEMINI_VISION_URL = f"{GEMINI_BASE_URL}/v1beta/models/gemini-1.5-flash:streamGenerateContent"
+GEMINI_UPLOAD_URL = f"{GEMINI_BASE_URL}/upload/v1beta/files"
 
+# Lado maior da imagem enviada ao Gemini (acima disso não melhora a análise)
+MAX_IMAGE_SIDE = 1024
+JPEG_QUALITY = 85
 
-def analyze_meal_photo(image_data: bytes, mime_type: str = "image/jpeg") -> Dict[str, Any]:
-    """
-    Analisa foto de refeição usando Gemini Vision
-    
-    Args:
-        image_data: Bytes da imagem
-        mime_type: Tipo MIME (image/jpeg, image/png)
-    
-    Returns:
-        Dict com análise dos alimentos
-    """
-    if not GEMINI_API_KEY:
-        return {
-            "success": False,
-            "error": "GEMINI_API_KEY não configurada",
-            "analysis": ""
-        }
-    
-    try:
-        # Codificar imagem em base64
-        image_b64 = base64.b64encode(image_data).decode('utf-8')
-        
-        # Prompt para análise de refeição
-        prompt = """Analise esta foto de refeição e identifique os alimentos visíveis.
+# Padrões para extrair itens e quantidades do texto da análise.
+# Item: "- Arroz branco: ~150g (cozido)" ou faixa "• Batata: 100-150 g"
+_RE_ITEM = re.compile(
+    r'^[ \t]*[-•][ \t]*(?P<nome>[^:\n]+):[ \t]*'
+    r'(?P<resto>(?:[^\n]*?~?(?P<min>\d+)(?:[ \t]*[-–][ \t]*(?P<max>\d+))?[ \t]*g\b)?[^\n]*)',
+    re.MULTILINE
+)
+_RE_KCAL = re.compile(r'(\d+)\s*kcal', re.IGNORECASE)
+
+# Marcador substituído pelo base64 da imagem já em bytes (ver _encode_payload)
+_B64_PLACEHOLDER = "__IMAGE_B64__"
+
+# Corpos de requisição prontos, por sha256 da imagem original (poucos itens:
+# no fallback inline cada corpo carrega a imagem inteira; TTL segue o do URI)
+_PAYLOAD_CACHE = LRUCache(maxsize=16, ttl=47 * 3600)
+
+# URIs de arquivos já enviados, por sha256 da imagem (Files API expira em 48h)
+_FILE_URI_CACHE = LRUCache(maxsize=256, ttl=47 * 3600)
+
+# Instruções fixas enviadas como system_instruction (prefixo idêntico a
+# cada chamada para aproveitar o cache de contexto); a imagem vai sozinha
+# na mensagem do usuário.
+MEAL_PHOTO_PROMPT = """Analise esta foto de refeição e identifique os alimentos visíveis.
 
 Forneça:
 1. Lista de alimentos identificados
@@ -61,164 +74,346 @@ Estimativa: ~650 kcal | Proteínas: ~40g | Carboidratos: ~75g | Gorduras: ~18g
 
 Seja preciso nas estimativas baseado no tamanho do prato e referências visuais."""
 
-        # Construir payload
-        payload = {
-            "contents": [
-                {
-                    "parts": [
-                        {"text": prompt},
-                        {
-                            "inline_data": {
-                                "mime_type": mime_type,
-                                "data": image_b64
-                            }
-                        }
-                    ]
-                }
-            ],
-            "generationConfig": {
-                "temperature": 0.4,
-                "maxOutputTokens": 1024
-            }
-        }
+
+def pick_photo_size(photo_list: List[Any]) -> Any:
+    """
+    Escolhe a menor versão da foto do Telegram que ainda cobre MAX_IMAGE_SIDE
+    
+    O Telegram envia várias resoluções da mesma foto; como a imagem será
+    reduzida para MAX_IMAGE_SIDE de qualquer forma, baixar a maior só
+    gasta tempo de download.
+    
+    Args:
+        photo_list: Lista de PhotoSize (message.photo, com width/height)
+    
+    Returns:
+        PhotoSize escolhido (a maior, se nenhuma cobrir o limite)
+    """
+    for photo in sorted(photo_list, key=lambda p: p.width * p.height):
+        if max(photo.width, photo.height) >= MAX_IMAGE_SIDE:
+            return photo
+    return photo_list[-1]
+
+
+def downscale_image(image_data: bytes, mime_type: str = "image/jpeg") -> Tuple[bytes, str]:
+    """
+    Reduz imagem para no máximo MAX_IMAGE_SIDE px no lado maior (JPEG)
+    
+    Args:
+        image_data: Bytes da imagem
+        mime_type: Tipo MIME original
+    
+    Returns:
+        (bytes, mime_type) reduzidos, ou os originais se já pequena,
+        se o Pillow não estiver instalado ou a imagem não puder ser lida
+    """
+    if Image is None:
+        return image_data, mime_type
+    
+    try:
+        img = Image.open(BytesIO(image_data))
+        if max(img.size) <= MAX_IMAGE_SIDE:
+            return image_data, mime_type
         
-        # Fazer requisição
-        url = f"{GEMINI_VISION_URL}?key={GEMINI_API_KEY}"
+        img.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE), Image.LANCZOS)
+        if img.mode != "RGB":
+            img = img.convert("RGB")
         
-        response = requests.post(
-            url,
-            json=payload,
-            timeout=30
-        )
+        buf = BytesIO()
+        img.save(buf, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        return buf.getvalue(), "image/jpeg"
         
-        if response.status_code == 200:
-            result = response.json()
-            
-            # Extrair texto da resposta
-            candidates = result.get("candidates", [])
-            if candidates:
-                content = candidates[0].get("content", {})
-                parts = content.get("parts", [])
-                
-                analysis_text = ""
-                for part in parts:
-                    analysis_text += part.get("text", "")
-                
-                return {
-                    "success": True,
-                    "analysis": analysis_text,
-                    "raw_response": result
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": "Sem candidatos na resposta",
-                    "raw_response": result
-                }
-        else:
-            return {
-                "success": False,
-                "error": f"API Error {response.status_code}: {response.text}",
-                "analysis": ""
-            }
-            
     except Exception as e:
-        return {
-            "success": False,
-            "error": str(e),
-            "analysis": ""
-        }
+        print(f"[AVISO] Redimensionando imagem: {e}")
+        return image_data, mime_type
 
 
-def extract_structured_meal_data(analysis_text: str) -> Dict[str, Any]:
+def upload_to_gemini(image_data: bytes, mime_type: str = "image/jpeg") -> Optional[str]:
     """
-    Extrai dados estruturados do texto de análise do Gemini
+    Envia imagem para a Files API do Gemini (upload resumível)
+    
+    O URI resultante fica em cache pelo sha256 da imagem, então a mesma
+    foto (ex: retentativas) é enviada apenas uma vez.
     
     Args:
-        analysis_text: Texto da análise do Gemini
+        image_data: Bytes da imagem
+        mime_type: Tipo MIME (image/jpeg, image/png)
     
     Returns:
-        Dict estruturado com alimentos
+        URI do arquivo ou None se o upload falhar
     """
-    # Implementação simplificada (pode ser melhorada com regex ou NLP adicional)
-    lines = analysis_text.split('\n')
-    
-    alimentos = []
-    total_calorias = 0
-    total_proteinas = 0
-    
-    for line in lines:
-        line = line.strip()
-        if line.startswith('-') or line.startswith('•'):
-            # Tentar extrair alimento e quantidade
-            # Exemplo: "- Arroz branco: ~150g (cozido)"
-            parts = line[1:].strip().split(':')
-            if len(parts) >= 2:
-                nome = parts[0].strip()
-                resto = ':'.join(parts[1:]).strip()
-                
-                # Tentar extrair gramas
-                import re
-                match = re.search(r'(\d+)g', resto)
-                quantidade = int(match.group(1)) if match else 0
-                
-                alimentos.append({
-                    "nome": nome,
-                    "quantidade_g": quantidade,
-                    "descricao": resto
-                })
-        
-        # Tentar extrair calorias totais
-        if "kcal" in line.lower():
-            import re
-            match = re.search(r'(\d+)\s*kcal', line.lower())
-            if match:
-                total_calorias = int(match.group(1))
+    digest = hashlib.sha256(image_data).hexdigest()
+    cached = _FILE_URI_CACHE.get(digest)
+    if cached:
+        return cached
     
-    return {
-        "alimentos": alimentos,
-        "total_calorias_estimada": total_calorias,
-        "analise_completa": analysis_text
-    }
+    try:
+        # Iniciar sessão de upload
+        start = _SESSION.post(
+            f"{GEMINI_UPLOAD_URL}?key={GEMINI_API_KEY}",
+            headers={
+                "X-Goog-Upload-Protocol": "resumable",
+                "X-Goog-Upload-Command": "start",
+                "X-Goog-Upload-Header-Content-Length": str(len(image_data)),
+                "X-Goog-Upload-Header-Content-Type": mime_type,
+                "Content-Type": "application/json"
+            },
+            data=orjson.dumps({"file": {"display_name": f"meal-{digest[:16]}"}}),
+            timeout=30
+        )
+        upload_url = start.headers.get("X-Goog-Upload-URL")
+        if start.status_code != 200 or not upload_url:
+            print(f"[AVISO] Upload Gemini não iniciado: {start.status_code}")
+            return None
+        
+        # Enviar bytes e finalizar
+        response = _SESSION.post(
+            upload_url,
+            headers={
+                "X-Goog-Upload-Offset": "0",
+                "X-Goog-Upload-Command": "upload, finalize"
+            },
+            data=image_data,
+            timeout=30
+        )
+        if response.status_code != 200:
+            print(f"[AVISO] Upload Gemini falhou: {response.status_code}")
+            return None
+        
+        uri = orjson.loads(response.content).get("file", {}).get("uri")
+        if uri:
+            _FILE_URI_CACHE.set(digest, uri)
+        return uri
+        
+    except Exception as e:
+        print(f"[AVISO] Upload Gemini: {e}")
+        return None
 
 
-def analyze_meal_from_telegram(file_url: str, bot_token: str) -> Dict[str, Any]:
+def analyze_meal_photo(image_data: bytes, mime_type: str = "image/jpeg") -> Dict[str, Any]:
     """
-    Baixa foto do Telegram e analisa
+    Analisa foto de refeição usando Gemini Vision
     
     Args:
-        file_url: URL do arquivo do Telegram
-        bot_token: Token do bot
+        image_data: Bytes da imagem
+        mime_type: Tipo MIME (image/jpeg, image/png)
     
     Returns:
-        Dict com análise
+        Dict com análise dos alimentos
     """
+    if not GEMINI_API_KEY:
+        return {
+            "success": False,
+            "error": "GEMINI_API_KEY não configurada",
+            "analysis": ""
+        }
+    
     try:
-        # Baixar foto
-        response = requests.get(file_url, timeout=30)
+        body = _build_payload(image_data, mime_type)
+        return _post(body)
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "analysis": ""
+        }
+
+
+def _build_payload(image_data: bytes, mime_type: str = "image/jpeg") -> bytes:
+    """
+    Monta o corpo JSON da requisição ao Gemini
+    
+    Redução, upload e serialização são feitos uma vez por imagem: o
+    resultado fica em cache pelo sha256, então retentativas com a mesma
+    foto só repetem o envio (_post).
+    """
+    key = (hashlib.sha256(image_data).hexdigest(), mime_type)
+    cached = _PAYLOAD_CACHE.get(key)
+    if cached is not None:
+        return cached
+    
+    # Reduzir antes de enviar (menos bytes e menos tokens de entrada)
+    image_data, mime_type = downscale_image(image_data, mime_type)
+    
+    # Referenciar imagem pela Files API (fallback: inline em base64)
+    file_uri = upload_to_gemini(image_data, mime_type)
+    if file_uri:
+        image_part = {
+            "file_data": {
+                "mime_type": mime_type,
+                "file_uri": file_uri
+            }
+        }
+    else:
+        image_part = {
+            "inline_data": {
+                "mime_type": mime_type,
+                "data": _B64_PLACEHOLDER
+            }
+        }
+    
+    payload = {
+        "system_instruction": {
+            "parts": [{"text": MEAL_PHOTO_PROMPT}]
+        },
+        "contents": [
+            {
+                "parts": [image_part]
+            }
+        ],
+        "generationConfig": {
+            "temperature": 0.4,
+            "maxOutputTokens": 1024
+        }
+    }
+    
+    body = _encode_payload(payload, None if file_uri else image_data)
+    _PAYLOAD_CACHE.set(key, body)
+    return body
+
+
+def _post(body: bytes) -> Dict[str, Any]:
+    """Envia corpo já serializado ao Gemini (SSE) e parseia a análise"""
+    url = f"{GEMINI_VISION_URL}?alt=sse&key={GEMINI_API_KEY}"
+    
+    with _SESSION.post(
+        url,
+        data=body,
+        headers={"Content-Type": "application/json"},
+        stream=True,
+        timeout=30
+    ) as response:
         if response.status_code != 200:
             return {
                 "success": False,
-                "error": f"Erro ao baixar foto: {response.status_code}",
+                "error": f"API Error {response.status_code}: {response.text}",
                 "analysis": ""
             }
         
-        # Analisar
-        result = analyze_meal_photo(response.content)
+        # Extrair texto de cada evento, já parseando as linhas completas
+        parser = MealAnalysisParser()
+        result = {}
+        has_candidates = False
         
-        # Se sucesso, extrair dados estruturados
-        if result["success"]:
-            structured = extract_structured_meal_data(result["analysis"])
-            result["structured"] = structured
+        for line in response.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            
+            result = orjson.loads(line[6:])
+            candidates = result.get("candidates", [])
+            if not candidates:
+                continue
+            
+            has_candidates = True
+            content = candidates[0].get("content", {})
+            for part in content.get("parts", []):
+                parser.feed(part.get("text", ""))
+    
+    if not has_candidates:
+        return {
+            "success": False,
+            "error": "Sem candidatos na resposta",
+            "raw_response": result
+        }
+    
+    structured = parser.finish()
+    return {
+        "success": True,
+        "analysis": structured["analise_completa"],
+        "structured": structured,
+        "raw_response": result  # último evento (finishReason/usageMetadata)
+    }
+
+
+def _encode_payload(payload: Dict[str, Any], image_data: Optional[bytes] = None) -> bytes:
+    """
+    Serializa payload em bytes JSON
+    
+    Se image_data for informado, o base64 da imagem é inserido direto no
+    lugar de _B64_PLACEHOLDER, sem virar str Python nem ser copiado de
+    novo pela serialização.
+    """
+    body = orjson.dumps(payload)
+    if image_data is None:
+        return body
+    
+    prefix, suffix = body.split(_B64_PLACEHOLDER.encode('ascii'), 1)
+    return b"".join((prefix, base64.b64encode(image_data), suffix))
+
+
+class MealAnalysisParser:
+    """
+    Parser incremental do texto de análise do Gemini
+    
+    Recebe o texto em partes (streaming) e processa cada linha assim que
+    ela termina, então ao fim da geração resta apenas a última linha.
+    """
+    
+    def __init__(self):
+        self.alimentos = []
+        self.total_calorias = 0
+        self._parts = []
+        self._pending = ""
+    
+    def feed(self, chunk: str) -> None:
+        """Adiciona texto; linhas completas são parseadas imediatamente"""
+        self._parts.append(chunk)
+        self._pending += chunk
         
-        return result
+        cut = self._pending.rfind("\n")
+        if cut != -1:
+            self._parse(self._pending[:cut + 1])
+            self._pending = self._pending[cut + 1:]
+    
+    def finish(self) -> Dict[str, Any]:
+        """Parseia o restante e retorna os dados estruturados"""
+        self._parse(self._pending)
+        self._pending = ""
         
-    except Exception as e:
         return {
-            "success": False,
-            "error": str(e),
-            "analysis": ""
+            "alimentos": self.alimentos,
+            "total_calorias_estimada": self.total_calorias,
+            "analise_completa": "".join(self._parts)
         }
+    
+    def _parse(self, text: str) -> None:
+        # Uma passada pelo texto: cada match é uma linha "- Nome: ~150g (...)"
+        for match in _RE_ITEM.finditer(text):
+            qty_min = int(match["min"]) if match["min"] else 0
+            qty_max = int(match["max"]) if match["max"] else qty_min
+            
+            self.alimentos.append({
+                "nome": match["nome"].strip(),
+                "quantidade_g": (qty_min + qty_max) // 2,
+                "quantidade_min_g": qty_min,
+                "quantidade_max_g": qty_max,
+                "descricao": match["resto"].strip()
+            })
+        
+        # Calorias totais: última menção a kcal no texto
+        for match in _RE_KCAL.finditer(text):
+            self.total_calorias = int(match.group(1))
+
+
+def extract_structured_meal_data(analysis_text: str) -> Dict[str, Any]:
+    """
+    Extrai dados estruturados do texto de análise do Gemini
+    
+    Args:
+        analysis_text: Texto da análise do Gemini
+    
+    Returns:
+        Dict estruturado com alimentos
+    """
+    parser = MealAnalysisParser()
+    parser.feed(analysis_text)
+    return parser.finish()
+
+
+# Abrir conexão já na importação (cold start), antes da primeira mensagem
+if GEMINI_API_KEY:
+    warm_connection(_SESSION, GEMINI_BASE_URL)
 
 
 if __name__ == "__main__":
@@ -7,27 +7,30 @@ Data: 2026-02-03
 """
 
 import os
+import re
 import json
-import requests
-from typing import Dict, Any, Optional
+import orjson
+import time
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from api.cache.lru import LRUCache
+from api.processors.rate_limit import RateLimiter
+from api.processors.session import SESSION as _SESSION, warm_connection
+from typing import Callable, Dict, Any, List, Optional, Tuple
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
-GROQ_CHAT_URL = "https://api.groq.com/openai/v1/chat/completions"
+GROQ_BASE_URL = "https://api.groq.com"
+GROQ_CHAT_URL = f"{GROQ_BASE_URL}/openai/v1/chat/completions"
 
+# Limite do plano gratuito Groq: 20 requisições/minuto
+_GROQ_LIMITER = RateLimiter(max_rate=20, time_period=60)
 
-def extract_meal_data(text: str) -> Dict[str, Any]:
-    """
-    Extrai dados de refeição de texto natural
-    
-    Args:
-        text: Texto descrevendo a refeição
-    
-    Returns:
-        Dict estruturado com alimentos e quantidades
-    """
-    prompt = f"""Analise este texto e extraia dados da refeição em formato JSON.
 
-Texto: "{text}"
+# Prompts fixos enviados como mensagem de sistema. Os bytes precisam ser
+# idênticos a cada chamada para aproveitar o cache de prefixo da API;
+# apenas o texto do usuário vai na mensagem seguinte.
+MEAL_PROMPT = """Analise o texto do usuário e extraia dados da refeição em formato JSON.
 
 Extraia:
 1. Tipo de refeição (café_da_manha, almoço, jantar, lanche)
@@ -36,36 +39,19 @@ Extraia:
 4. Observações relevantes
 
 Responda APENAS com JSON válido, exemplo:
-{{
+{
     "tipo": "almoço",
     "horario": "12:30",
     "alimentos": [
-        {{"nome": "arroz_branco", "quantidade_g": 150, "descricao": "cozido"}},
-        {{"nome": "feijao_carioca", "quantidade_g": 100, "descricao": ""}},
-        {{"nome": "peito_frango", "quantidade_g": 120, "descricao": "grelhado"}},
-        {{"nome": "salada_verde", "quantidade_g": 80, "descricao": "alface e tomate"}}
+        {"nome": "arroz_branco", "quantidade_g": 150, "descricao": "cozido"},
+        {"nome": "feijao_carioca", "quantidade_g": 100, "descricao": ""},
+        {"nome": "peito_frango", "quantidade_g": 120, "descricao": "grelhado"},
+        {"nome": "salada_verde", "quantidade_g": 80, "descricao": "alface e tomate"}
     ],
     "observacoes": ""
-}}
-
-JSON:"""
-    
-    return _call_groq(prompt, model="llama-3.1-8b-instant")
+}"""
 
-
-def extract_workout_data(text: str) -> Dict[str, Any]:
-    """
-    Extrai dados de treino de texto natural
-    
-    Args:
-        text: Texto descrevendo o treino
-    
-    Returns:
-        Dict estruturado com exercícios
-    """
-    prompt = f"""Analise este texto e extraia dados do treino em formato JSON.
-
-Texto: "{text}"
+WORKOUT_PROMPT = """Analise o texto do usuário e extraia dados do treino em formato JSON.
 
 Extraia:
 1. Grupo muscular (peito, costas, pernas, ombros, bracos, etc)
@@ -74,20 +60,248 @@ Extraia:
 4. Observações (RPE, técnica, etc)
 
 Responda APENAS com JSON válido, exemplo:
-{{
+{
     "grupo_muscular": "peito",
     "horario": "18:00",
     "exercicios": [
-        {{"nome": "supino_reto", "series": 4, "repeticoes": "8-10", "carga_kg": 80}},
-        {{"nome": "crucifixo_halteres", "series": 3, "repeticoes": 12, "carga_kg": 20}},
-        {{"nome": "supino_inclinado", "series": 3, "repeticoes": 10, "carga_kg": 60}}
+        {"nome": "supino_reto", "series": 4, "repeticoes": "8-10", "carga_kg": 80},
+        {"nome": "crucifixo_halteres", "series": 3, "repeticoes": 12, "carga_kg": 20},
+        {"nome": "supino_inclinado", "series": 3, "repeticoes": 10, "carga_kg": 60}
     ],
     "observacoes": "Foco na contração, RPE 8-9"
-}}
+}"""
+
+HYDRATION_PROMPT = """Analise o texto do usuário e extraia dados de hidratação em JSON.
 
-JSON:"""
+Extraia:
+1. Quantidade em ml
+2. Tipo (agua, cha, cafe, suco, etc)
+3. Horário se mencionado
+
+Exemplo:
+{
+    "tipo": "agua",
+    "quantidade_ml": 500,
+    "horario": "14:30",
+    "observacoes": ""
+}"""
+
+INTENT_PROMPT = """Classifique a intenção do texto do usuário em UMA palavra:
+- meal (refeição)
+- workout (treino)
+- hydration (hidratacao)
+- supplement (suplemento)
+- question (duvida)
+- greeting (saudacao)
+- other (outro)
+
+Resposta (apenas uma palavra)."""
+
+# JSON Schemas para geração guiada (saída sempre JSON válido e curta)
+_NULLABLE_STR = {"type": ["string", "null"]}
+
+MEAL_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "tipo": {"type": "string", "enum": ["café_da_manha", "almoço", "jantar", "lanche"]},
+        "horario": _NULLABLE_STR,
+        "alimentos": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "nome": {"type": "string"},
+                    "quantidade_g": {"type": "number"},
+                    "descricao": {"type": "string"}
+                },
+                "required": ["nome", "quantidade_g", "descricao"]
+            }
+        },
+        "observacoes": {"type": "string"}
+    },
+    "required": ["tipo", "horario", "alimentos", "observacoes"]
+}
+
+WORKOUT_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "grupo_muscular": {"type": "string"},
+        "horario": _NULLABLE_STR,
+        "exercicios": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "nome": {"type": "string"},
+                    "series": {"type": "integer"},
+                    "repeticoes": {"type": ["string", "integer"]},
+                    "carga_kg": {"type": ["number", "null"]}
+                },
+                "required": ["nome", "series", "repeticoes", "carga_kg"]
+            }
+        },
+        "observacoes": {"type": "string"}
+    },
+    "required": ["grupo_muscular", "horario", "exercicios", "observacoes"]
+}
+
+HYDRATION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "tipo": {"type": "string"},
+        "quantidade_ml": {"type": "number"},
+        "horario": _NULLABLE_STR,
+        "observacoes": {"type": "string"}
+    },
+    "required": ["tipo", "quantidade_ml", "horario", "observacoes"]
+}
+
+# Modelos que recusaram response_format json_schema (usam json_object)
+_SCHEMA_UNSUPPORTED = set()
+
+# Mensagens triviais que não precisam de LLM
+_TRIVIAL_INTENTS = {
+    "ok": "other",
+    "sim": "other",
+    "não": "other",
+    "nao": "other",
+    "obrigado": "other",
+    "obrigada": "other",
+    "valeu": "other",
+}
+_RE_GREETING = re.compile(r'^(oi+|olá|ola|e a[ií]|bom dia|boa tarde|boa noite|hey|hello|hi)[!. ]*$')
+_RE_WATER = re.compile(r'^\d+\s*ml( de)?( h2o| água| agua)?[!. ]*$')
+
+# Palavras-chave por intenção (peso 2 = verbo/termo decisivo)
+_INTENT_KEYWORDS = {
+    "hydration": {
+        "bebi": 2, "água": 2, "agua": 2, "h2o": 2, "hidratação": 2, "hidratacao": 2,
+        "ml": 1, "litro": 1, "litros": 1, "copo": 1, "copos": 1, "garrafa": 1,
+    },
+    "meal": {
+        "comi": 2, "almocei": 2, "jantei": 2, "lanchei": 2, "refeição": 2, "refeicao": 2,
+        "almoço": 1, "almoco": 1, "jantar": 1, "café": 1, "cafe": 1, "lanche": 1,
+        "arroz": 1, "feijão": 1, "feijao": 1, "frango": 1, "carne": 1, "ovo": 1,
+        "ovos": 1, "salada": 1, "pão": 1, "pao": 1,
+    },
+    "workout": {
+        "treinei": 2, "treino": 2, "supino": 2, "agachamento": 2, "musculação": 2,
+        "musculacao": 2, "séries": 1, "series": 1, "rpe": 1, "repetições": 1,
+        "repeticoes": 1, "reps": 1, "academia": 1, "kg": 1, "corri": 2,
+    },
+    "supplement": {
+        "creatina": 2, "whey": 2, "suplemento": 2, "multivitamínico": 2,
+        "multivitaminico": 2, "ômega": 1, "omega": 1, "cápsula": 1, "capsula": 1,
+    },
+}
+_LOCAL_MIN_SCORE = 2
+_LOCAL_MIN_MARGIN = 2
+# Perguntas, negações e modais mudam o sentido ("não bebi água", "quanto de
+# água devo beber?"): nesses casos a classificação local não decide
+_LOCAL_SKIP_WORDS = frozenset({
+    "não", "nao", "nem", "nunca", "sem",
+    "quanto", "quanta", "quantos", "quantas", "qual", "quais", "como",
+    "posso", "devo", "pode", "deve",
+})
+_RE_WORD = re.compile(r'[^\W\d_]+')
+
+VALID_INTENTS = ["meal", "workout", "hydration", "supplement", "question", "greeting", "other"]
+
+# Classificação + extração numa só chamada (ver extract_any)
+ANY_PROMPT = """Classifique o texto do usuário e, se for refeição, treino ou hidratação, extraia os dados em JSON.
+
+"kind" é UMA palavra:
+- meal (refeição)
+- workout (treino)
+- hydration (hidratacao)
+- supplement (suplemento)
+- question (duvida)
+- greeting (saudacao)
+- other (outro)
+
+Preencha apenas o campo correspondente a "kind" ("meal", "workout" ou "hydration"); os demais ficam null.
+- meal: tipo (café_da_manha, almoço, jantar, lanche), horario, alimentos [{nome, quantidade_g, descricao}], observacoes
+- workout: grupo_muscular, horario, exercicios [{nome, series, repeticoes, carga_kg}], observacoes
+- hydration: tipo (agua, cha, cafe, suco, etc), quantidade_ml, horario, observacoes
+
+Responda APENAS com JSON válido, exemplo:
+{
+    "kind": "hydration",
+    "meal": null,
+    "workout": null,
+    "hydration": {"tipo": "agua", "quantidade_ml": 500, "horario": "14:30", "observacoes": ""}
+}"""
+
+ANY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "kind": {"type": "string", "enum": VALID_INTENTS},
+        "meal": {"anyOf": [MEAL_SCHEMA, {"type": "null"}]},
+        "workout": {"anyOf": [WORKOUT_SCHEMA, {"type": "null"}]},
+        "hydration": {"anyOf": [HYDRATION_SCHEMA, {"type": "null"}]}
+    },
+    "required": ["kind", "meal", "workout", "hydration"]
+}
+
+# Versão em lote de ANY_PROMPT (ver GroqBatcher): um objeto por texto
+ANY_BATCH_PROMPT = """Para cada texto numerado do usuário, classifique e, se for refeição, treino ou hidratação, extraia os dados em JSON.
+
+"kind" é UMA palavra:
+- meal (refeição)
+- workout (treino)
+- hydration (hidratacao)
+- supplement (suplemento)
+- question (duvida)
+- greeting (saudacao)
+- other (outro)
+
+Preencha apenas o campo correspondente a "kind" ("meal", "workout" ou "hydration"); os demais ficam null.
+- meal: tipo (café_da_manha, almoço, jantar, lanche), horario, alimentos [{nome, quantidade_g, descricao}], observacoes
+- workout: grupo_muscular, horario, exercicios [{nome, series, repeticoes, carga_kg}], observacoes
+- hydration: tipo (agua, cha, cafe, suco, etc), quantidade_ml, horario, observacoes
+
+Responda APENAS com JSON válido, um objeto por texto na mesma ordem, exemplo:
+{"items": [{"kind": "greeting", "meal": null, "workout": null, "hydration": null}]}"""
+
+ANY_BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "items": {"type": "array", "items": ANY_SCHEMA}
+    },
+    "required": ["items"]
+}
+
+
+def extract_meal_data(text: str) -> Dict[str, Any]:
+    """
+    Extrai dados de refeição de texto natural
+    
+    Args:
+        text: Texto descrevendo a refeição
     
-    return _call_groq(prompt, model="llama-3.1-8b-instant")
+    Returns:
+        Dict estruturado com alimentos e quantidades
+    """
+    return _call_groq(
+        text, model="llama-3.1-8b-instant", system=MEAL_PROMPT,
+        schema=("meal", MEAL_SCHEMA), max_tokens=256
+    )
+
+
+def extract_workout_data(text: str) -> Dict[str, Any]:
+    """
+    Extrai dados de treino de texto natural
+    
+    Args:
+        text: Texto descrevendo o treino
+    
+    Returns:
+        Dict estruturado com exercícios
+    """
+    return _call_groq(
+        text, model="llama-3.1-8b-instant", system=WORKOUT_PROMPT,
+        schema=("workout", WORKOUT_SCHEMA), max_tokens=300
+    )
 
 
 def extract_hydration_data(text: str) -> Dict[str, Any]:
@@ -100,60 +314,269 @@ def extract_hydration_data(text: str) -> Dict[str, Any]:
     Returns:
         Dict com quantidade e tipo
     """
-    prompt = f"""Analise e extraia dados de hidratação em JSON.
-
-Texto: "{text}"
+    return _call_groq(
+        text, model="llama-3.1-8b-instant", system=HYDRATION_PROMPT,
+        schema=("hydration", HYDRATION_SCHEMA), max_tokens=128
+    )
 
-Extraia:
-1. Quantidade em ml
-2. Tipo (agua, cha, cafe, suco, etc)
-3. Horário se mencionado
-
-Exemplo:
-{{
-    "tipo": "agua",
-    "quantidade_ml": 500,
-    "horario": "14:30",
-    "observacoes": ""
-}}
 
-JSON:"""
+def extract_any(text: str) -> Dict[str, Any]:
+    """
+    Classifica e extrai dados numa única etapa
+    
+    Se a intenção já é conhecida localmente (trivial, palavras-chave ou
+    cache) chama só o extrator correspondente; senão uma única requisição
+    devolve intenção e dados juntos, evitando classify_intent + extract_*.
+    Chamadas concorrentes dessa requisição são agrupadas pelo GroqBatcher.
+    
+    Args:
+        text: Texto do usuário
+    
+    Returns:
+        Dict com "kind" (intenção) e "data" (dados extraídos ou None)
+    """
+    norm = _normalize_text(text)
+    intent = _trivial_intent(norm) or _local_intent(norm) or _INTENT_CACHE.get(norm)
     
-    return _call_groq(prompt, model="llama-3.1-8b-instant")
+    if intent:
+        extractor = _EXTRACTORS.get(intent)
+        return {"kind": intent, "data": extractor(text) if extractor else None}
+    
+    result = _ANY_BATCHER.submit(text)
+    if "kind" not in result:
+        return {"kind": "other", "data": None, "error": result.get("error")}
+    
+    intent = _normalize_intent(str(result["kind"]))
+    _INTENT_CACHE.set(norm, intent)
+    return {"kind": intent, "data": result.get(intent) if intent in _EXTRACTORS else None}
 
 
 def classify_intent(text: str) -> str:
     """
     Classifica a intenção do usuário
     
+    Casos triviais e o classificador local não chamam a API; os demais
+    fazem uma requisição Groq (resultado guardado em cache).
+    
     Args:
         text: Texto do usuário
     
     Returns:
         Categoria: meal, workout, hydration, question, greeting, other
     """
-    prompt = f"""Classifique a intenção deste texto em UMA palavra:
-- meal (refeição)
-- workout (treino)
-- hydration (hidratacao)
-- supplement (suplemento)
-- question (duvida)
-- greeting (saudacao)
-- other (outro)
+    norm = _normalize_text(text)
+    
+    # Casos triviais resolvidos sem chamada de rede
+    trivial = _trivial_intent(norm)
+    if trivial:
+        return trivial
+    
+    # Classificador local por palavras-chave (só quando há margem clara)
+    local = _local_intent(norm)
+    if local:
+        return local
+    
+    cached = _INTENT_CACHE.get(norm)
+    if cached:
+        return cached
+    
+    intent = _classify_single(text)
+    if intent is None:
+        # Falha na API: não guardar em cache
+        return "other"
+    
+    _INTENT_CACHE.set(norm, intent)
+    return intent
+
+
+def _normalize_text(text: str) -> str:
+    """Chave de cache: minúsculas, espaços normalizados, prefixo de 128 chars"""
+    return " ".join(text.lower().split())[:128]
+
+
+def _trivial_intent(norm: str) -> Optional[str]:
+    """Intenção de mensagens triviais (saudações, "500ml de água", "ok")"""
+    if norm in _TRIVIAL_INTENTS:
+        return _TRIVIAL_INTENTS[norm]
+    if _RE_GREETING.match(norm):
+        return "greeting"
+    if _RE_WATER.match(norm):
+        return "hydration"
+    return None
+
+
+def _local_intent(norm: str) -> Optional[str]:
+    """
+    Classifica por palavras-chave ponderadas
+    
+    Retorna a intenção apenas se a pontuação vencedora atingir
+    _LOCAL_MIN_SCORE com margem de _LOCAL_MIN_MARGIN sobre a segunda;
+    caso contrário None (decide o LLM). Perguntas e frases com negação
+    ou modal (_LOCAL_SKIP_WORDS) também ficam para o LLM.
+    """
+    if "?" in norm:
+        return None
+    
+    words = _RE_WORD.findall(norm)
+    if _LOCAL_SKIP_WORDS.intersection(words):
+        return None
+    
+    scores = dict.fromkeys(_INTENT_KEYWORDS, 0)
+    for word in words:
+        for intent, keywords in _INTENT_KEYWORDS.items():
+            scores[intent] += keywords.get(word, 0)
+    
+    ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    (best, best_score), (_, second_score) = ranked[0], ranked[1]
+    
+    if best_score >= _LOCAL_MIN_SCORE and best_score - second_score >= _LOCAL_MIN_MARGIN:
+        return best
+    return None
+
+
+def _classify_single(text: str) -> Optional[str]:
+    """Classifica um único texto (uma requisição Groq); None se a API falhar"""
+    result = _call_groq(text, model="gemma2-9b-it", json_mode=False, system=INTENT_PROMPT)
+    if "text" not in result:
+        return None
+    return _normalize_intent(result["text"])
+
+
+def _normalize_intent(intent: str) -> str:
+    """Normaliza resposta do modelo para uma intenção válida"""
+    intent = intent.strip().lower()
+    return intent if intent in VALID_INTENTS else "other"
+
+
+def _extract_any_single(text: str) -> Dict[str, Any]:
+    """Classifica e extrai um texto em uma requisição Groq"""
+    return _call_groq(
+        text, model="llama-3.1-8b-instant", system=ANY_PROMPT,
+        schema=("any", ANY_SCHEMA), max_tokens=400
+    )
+
+
+def _extract_any_batch(texts: List[str]) -> List[Dict[str, Any]]:
+    """Classifica e extrai vários textos em uma única requisição Groq"""
+    numbered = "\n".join(f"{i}. {orjson.dumps(t).decode()}" for i, t in enumerate(texts))
+    result = _call_groq(
+        numbered, model="llama-3.1-8b-instant", system=ANY_BATCH_PROMPT,
+        schema=("any_batch", ANY_BATCH_SCHEMA), max_tokens=400 * len(texts)
+    )
+    items = result.get("items")
+    
+    if result.get("success") is False and "raw" not in result:
+        # Falha na API (não JSON inválido): repetir por item só multiplicaria as chamadas
+        return [result] * len(texts)
+    
+    if not isinstance(items, list) or len(items) != len(texts) or not all(isinstance(i, dict) for i in items):
+        # Resposta fora do formato: processar individualmente
+        return [_extract_any_single(t) for t in texts]
+    
+    return items
 
-Texto: "{text}"
 
-Resposta (apenas uma palavra):"""
+class GroqBatcher:
+    """
+    Agrupa requisições concorrentes em uma única chamada Groq
+    
+    Cada chamada entra numa fila; uma thread coleta até `max_batch` itens
+    ou espera no máximo `max_wait_ms` e envia o lote num só prompt,
+    devolvendo cada resultado ao Future da chamada original. Lote de um
+    item só usa `single`.
+    """
     
-    result = _call_groq(prompt, model="gemma2-9b-it", json_mode=False)
-    intent = result.get("text", "other").strip().lower()
+    def __init__(
+        self,
+        single: Callable[[str], Dict[str, Any]],
+        batch: Callable[[List[str]], List[Dict[str, Any]]],
+        max_batch: int = 16,
+        max_wait_ms: int = 30
+    ):
+        self.single = single
+        self.batch = batch
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue" = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="groq-batch")
+        self._worker = None
+        self._lock = threading.Lock()
+    
+    def submit(self, text: str) -> Dict[str, Any]:
+        """Enfileira texto e aguarda o resultado do lote"""
+        self._ensure_worker()
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future.result()
+    
+    def _ensure_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="groq-batcher", daemon=True)
+                self._worker.start()
+    
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            
+            while len(items) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            # Enviar em outra thread para continuar coletando o próximo lote
+            self._executor.submit(self._dispatch, items)
     
-    valid_intents = ["meal", "workout", "hydration", "supplement", "question", "greeting", "other"]
-    return intent if intent in valid_intents else "other"
+    def _dispatch(self, items):
+        texts = [text for text, _ in items]
+        try:
+            if len(texts) == 1:
+                results = [self.single(texts[0])]
+            else:
+                results = self.batch(texts)
+        except Exception as e:
+            print(f"[ERRO] Requisição em lote: {e}")
+            results = [{"success": False, "error": str(e)}] * len(texts)
+        
+        for (_, future), result in zip(items, results):
+            future.set_result(result)
+
+
+_ANY_BATCHER = GroqBatcher(_extract_any_single, _extract_any_batch)
+
+
+# Extrator por intenção (usado por extract_any)
+_EXTRACTORS = {
+    "meal": extract_meal_data,
+    "workout": extract_workout_data,
+    "hydration": extract_hydration_data,
+}
 
+# Intenções já classificadas, pelo texto normalizado. LRUCache em vez de
+# functools.lru_cache para não memorizar falhas da API.
+_INTENT_CACHE = LRUCache(maxsize=4096)
 
-def _call_groq(prompt: str, model: str = "llama-3.1-8b-instant", json_mode: bool = True) -> Dict[str, Any]:
-    """Chama API Groq"""
+
+def _call_groq(
+    prompt: str,
+    model: str = "llama-3.1-8b-instant",
+    json_mode: bool = True,
+    system: Optional[str] = None,
+    schema: Optional[Tuple[str, Dict[str, Any]]] = None,
+    max_tokens: int = 1000
+) -> Dict[str, Any]:
+    """
+    Chama API Groq
+    
+    A mensagem de sistema vai primeiro para reaproveitar cache de prefixo.
+    Com `schema` (nome, JSON Schema) a saída é guiada pelo schema; se o
+    modelo não suportar json_schema, repete com json_object.
+    """
     
     if not GROQ_API_KEY:
         return {"success": False, "error": "GROQ_API_KEY não configurada"}
@@ -163,33 +586,56 @@ def _call_groq(prompt: str, model: str = "llama-3.1-8b-instant", json_mode: bool
         "Content-Type": "application/json"
     }
     
+    messages = [{"role": "user", "content": prompt}]
+    if system:
+        messages.insert(0, {"role": "system", "content": system})
+    
     payload = {
         "model": model,
-        "messages": [{"role": "user", "content": prompt}],
+        "messages": messages,
         "temperature": 0.1,
-        "max_tokens": 1000
+        "max_tokens": max_tokens
     }
     
-    if json_mode:
+    if schema and model in _SCHEMA_UNSUPPORTED:
+        schema = None
+    
+    if schema:
+        name, json_schema = schema
+        payload["response_format"] = {
+            "type": "json_schema",
+            "json_schema": {"name": name, "schema": json_schema}
+        }
+    elif json_mode:
         payload["response_format"] = {"type": "json_object"}
     
     try:
-        response = requests.post(
+        _GROQ_LIMITER.acquire()
+        response = _SESSION.post(
             GROQ_CHAT_URL,
             headers=headers,
-            json=payload,
+            data=orjson.dumps(payload),
             timeout=30
         )
         
+        if response.status_code == 400 and schema and _is_schema_error(response.text):
+            # Modelo sem suporte a json_schema: cair para json_object
+            _SCHEMA_UNSUPPORTED.add(model)
+            payload["response_format"] = {"type": "json_object"}
+            _GROQ_LIMITER.acquire()
+            response = _SESSION.post(
+                GROQ_CHAT_URL,
+                headers=headers,
+                data=orjson.dumps(payload),
+                timeout=30
+            )
+        
         if response.status_code == 200:
-            result = response.json()
+            result = orjson.loads(response.content)
             content = result["choices"][0]["message"]["content"]
             
-            if json_mode:
-                try:
-                    return json.loads(content)
-                except:
-                    return {"success": False, "error": "JSON inválido", "raw": content}
+            if json_mode or schema:
+                return _parse_json_content(content)
             else:
                 return {"success": True, "text": content}
         else:
@@ -202,10 +648,47 @@ def _call_groq(prompt: str, model: str = "llama-3.1-8b-instant", json_mode: bool
         return {"success": False, "error": str(e)}
 
 
+def _is_schema_error(body: str) -> bool:
+    """400 causado pelo response_format (e não por outro erro da requisição)"""
+    body = body.lower()
+    return "response_format" in body or "json_schema" in body
+
+
+def _parse_json_content(content: str) -> Dict[str, Any]:
+    """Parse tolerante: ignora texto antes do primeiro '{' e após o último '}'"""
+    try:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError:
+        pass
+    
+    start, end = content.find("{"), content.rfind("}")
+    if start != -1 and end > start:
+        try:
+            return orjson.loads(content[start:end + 1])
+        except orjson.JSONDecodeError:
+            pass
+    
+    return {"success": False, "error": "JSON inválido", "raw": content}
+
+
+# Abrir conexão já na importação (cold start), antes da primeira mensagem
+if GROQ_API_KEY:
+    warm_connection(_SESSION, GROQ_BASE_URL)
+
+
 if __name__ == "__main__":
     # Testes
     print("[TESTE] Groq LLM Integration\n")
     
+    # Teste 0: Classificação local não decide perguntas nem negações
+    for sample in ("quanto de água devo beber por dia?", "água com gás engorda?",
+                   "não bebi água hoje", "qual o melhor treino de supino?",
+                   "hoje não treinei"):
+        assert _local_intent(_normalize_text(sample)) is None, sample
+    assert _local_intent(_normalize_text("bebi 2 copos de água")) == "hydration"
+    assert _local_intent(_normalize_text("treinei supino")) == "workout"
+    print("Classificação local: OK\n")
+    
     # Teste 1: Refeição
     text1 = "Almocei 200g de arroz com feijão e um peito de frango grelhado"
     print(f"Texto: {text1}")
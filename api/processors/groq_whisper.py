@@ -7,12 +7,18 @@ Data: 2026-02-03
 """
 
 import os
-import requests
+import orjson
+from api.processors.rate_limit import RateLimiter
+from api.processors.session import SESSION as _SESSION, warm_connection
 import base64
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, BinaryIO
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
-GROQ_WHISPER_URL = "https://api.groq.com/openai/v1/audio/transcriptions"
+GROQ_BASE_URL = "https://api.groq.com"
+GROQ_WHISPER_URL = f"{GROQ_BASE_URL}/openai/v1/audio/transcriptions"
+
+# Limite do plano gratuito Groq Whisper: 20 requisições/minuto
+_WHISPER_LIMITER = RateLimiter(max_rate=20, time_period=60)
 
 
 def transcribe_audio(file_path: str, language: str = "pt") -> Dict[str, Any]:
@@ -35,44 +41,7 @@ def transcribe_audio(file_path: str, language: str = "pt") -> Dict[str, Any]:
     
     try:
         with open(file_path, 'rb') as audio_file:
-            files = {
-                'file': (os.path.basename(file_path), audio_file, 'audio/ogg')
-            }
-            
-            data = {
-                'model': 'whisper-large-v3',
-                'language': language,
-                'response_format': 'json'
-            }
-            
-            headers = {
-                'Authorization': f'Bearer {GROQ_API_KEY}'
-            }
-            
-            response = requests.post(
-                GROQ_WHISPER_URL,
-                headers=headers,
-                files=files,
-                data=data,
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                return {
-                    "success": True,
-                    "text": result.get("text", ""),
-                    "language": result.get("language", language),
-                    "duration": result.get("duration", 0),
-                    "confidence": 0.95  # Whisper é muito preciso
-                }
-            else:
-                return {
-                    "success": False,
-                    "error": f"API Error {response.status_code}: {response.text}",
-                    "text": ""
-                }
-                
+            return _transcribe_fileobj(audio_file, os.path.basename(file_path), language)
     except Exception as e:
         return {
             "success": False,
@@ -81,42 +50,27 @@ def transcribe_audio(file_path: str, language: str = "pt") -> Dict[str, Any]:
         }
 
 
-def transcribe_from_telegram(file_url: str, bot_token: str, language: str = "pt") -> Dict[str, Any]:
+def transcribe_file(audio_file: BinaryIO, filename: str = "voice.ogg", language: str = "pt") -> Dict[str, Any]:
     """
-    Baixa áudio do Telegram e transcreve
+    Transcreve áudio já baixado (bytes em memória ou arquivo temporário)
     
     Args:
-        file_url: URL do arquivo do Telegram
-        bot_token: Token do bot
+        audio_file: Objeto tipo arquivo posicionado no início do áudio
+        filename: Nome enviado ao Whisper (a extensão indica o formato)
         language: Idioma
     
     Returns:
         Dict com resultado da transcrição
     """
+    if not GROQ_API_KEY:
+        return {
+            "success": False,
+            "error": "GROQ_API_KEY não configurada",
+            "text": ""
+        }
+    
     try:
-        # Baixar áudio do Telegram
-        response = requests.get(file_url, timeout=30)
-        if response.status_code != 200:
-            return {
-                "success": False,
-                "error": f"Erro ao baixar áudio: {response.status_code}",
-                "text": ""
-            }
-        
-        # Salvar temporariamente
-        temp_path = "/tmp/voice_message.ogg"
-        with open(temp_path, 'wb') as f:
-            f.write(response.content)
-        
-        # Transcrever
-        result = transcribe_audio(temp_path, language)
-        
-        # Limpar arquivo temporário
-        if os.path.exists(temp_path):
-            os.remove(temp_path)
-        
-        return result
-        
+        return _transcribe_fileobj(audio_file, filename, language)
     except Exception as e:
         return {
             "success": False,
@@ -125,6 +79,59 @@ def transcribe_from_telegram(file_url: str, bot_token: str, language: str = "pt"
         }
 
 
+def _transcribe_fileobj(audio_file: BinaryIO, filename: str, language: str = "pt") -> Dict[str, Any]:
+    """
+    Envia áudio (qualquer objeto tipo arquivo) ao Groq Whisper
+    
+    O multipart do requests lê o arquivo inteiro antes de enviar (não há
+    streaming do corpo); o webhook já entrega o áudio baixado em um
+    SpooledTemporaryFile.
+    """
+    files = {
+        'file': (filename, audio_file, 'audio/ogg')
+    }
+    
+    data = {
+        'model': 'whisper-large-v3',
+        'language': language,
+        'response_format': 'json'
+    }
+    
+    headers = {
+        'Authorization': f'Bearer {GROQ_API_KEY}'
+    }
+    
+    _WHISPER_LIMITER.acquire()
+    response = _SESSION.post(
+        GROQ_WHISPER_URL,
+        headers=headers,
+        files=files,
+        data=data,
+        timeout=30
+    )
+    
+    if response.status_code == 200:
+        result = orjson.loads(response.content)
+        return {
+            "success": True,
+            "text": result.get("text", ""),
+            "language": result.get("language", language),
+            "duration": result.get("duration", 0),
+            "confidence": 0.95  # Whisper é muito preciso
+        }
+    else:
+        return {
+            "success": False,
+            "error": f"API Error {response.status_code}: {response.text}",
+            "text": ""
+        }
+
+
+# Abrir conexão já na importação (cold start), antes da primeira mensagem
+if GROQ_API_KEY:
+    warm_connection(_SESSION, GROQ_BASE_URL)
+
+
 if __name__ == "__main__":
     # Teste
     import sys
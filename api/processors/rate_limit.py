@@ -0,0 +1,55 @@
+"""
+Rate Limiter - Limite de Requisições por Janela
+================================================
+Evita 429 esperando localmente o mínimo necessário antes de chamar a API
+
+Data: 2026-02-03
+"""
+
+import time
+import threading
+from collections import deque
+
+
+class RateLimiter:
+    """
+    Limitador de janela deslizante thread-safe
+
+    Permite no máximo `max_rate` chamadas a cada `time_period` segundos.
+    `acquire()` bloqueia até haver vaga; se a espera passar de `max_wait`
+    a chamada segue mesmo assim (a retentativa HTTP trata um eventual 429).
+    """
+
+    def __init__(self, max_rate: int, time_period: float = 60, max_wait: float = 10):
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self.max_wait = max_wait
+        self._calls: deque = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """
+        Aguarda vaga na janela e registra a chamada
+
+        Returns:
+            Tempo esperado em segundos
+        """
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._calls and now - self._calls[0] >= self.time_period:
+                    self._calls.popleft()
+
+                if len(self._calls) < self.max_rate:
+                    self._calls.append(now)
+                    return waited
+
+                wait = self._calls[0] + self.time_period - now
+                if waited + wait > self.max_wait:
+                    self._calls.append(now)
+                    return waited
+
+            time.sleep(wait)
+            waited += wait
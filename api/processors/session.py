@@ -0,0 +1,84 @@
+"""
+HTTP Session - Conexões Reutilizáveis
+======================================
+Sessões requests com pool de conexões keep-alive para os processadores
+
+Data: 2026-02-03
+"""
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import Future, ThreadPoolExecutor
+
+POOL_CONNECTIONS = 20
+POOL_MAXSIZE = 100
+
+# Retentativa com backoff exponencial para falhas transitórias (rate limit,
+# 5xx, conexão). Sem raise_on_status: após a última tentativa a resposta
+# volta normalmente e os processadores reportam o erro como antes.
+# read=0: timeout de leitura não é repetido; o POST pode já ter sido
+# processado (chamada cobrada de novo / mensagem duplicada no Telegram).
+RETRY_POLICY = Retry(
+    total=3,
+    read=0,
+    backoff_factor=0.3,
+    status_forcelist=(429, 500, 502, 503, 504),
+    allowed_methods=frozenset({"GET", "HEAD", "POST"}),
+    respect_retry_after_header=True,
+    raise_on_status=False
+)
+
+# Threads para trabalho de rede em paralelo (ex: aquecer conexão)
+_EXECUTOR = ThreadPoolExecutor(max_workers=4, thread_name_prefix="http")
+
+
+def build_session() -> requests.Session:
+    """
+    Cria sessão HTTP com pool de conexões
+
+    Reaproveita conexões TCP+TLS entre chamadas (keep-alive), evitando
+    um novo handshake a cada requisição para Groq/Gemini/Telegram, e
+    aplica RETRY_POLICY a todas as requisições.
+
+    Returns:
+        requests.Session configurada
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=POOL_CONNECTIONS,
+        pool_maxsize=POOL_MAXSIZE,
+        max_retries=RETRY_POLICY
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+# Sessão única do processo: Groq (NLP + Whisper), Gemini e Telegram dividem
+# o mesmo pool, então chamadas ao mesmo host reaproveitam as mesmas conexões
+SESSION = build_session()
+
+
+def warm_connection(session: requests.Session, url: str, timeout: float = 5) -> Future:
+    """
+    Abre conexão com o host em background
+
+    Faz um HEAD para que o handshake TCP+TLS aconteça em paralelo a outro
+    trabalho (ex: download do Telegram); a conexão fica no pool da sessão
+    para a chamada seguinte ao modelo.
+
+    Args:
+        session: Sessão cujo pool receberá a conexão
+        url: URL do host a aquecer
+        timeout: Timeout em segundos
+
+    Returns:
+        Future da requisição (erros são ignorados)
+    """
+    def _warm():
+        try:
+            session.head(url, timeout=timeout)
+        except requests.RequestException:
+            pass
+
+    return _EXECUTOR.submit(_warm)
@@ -0,0 +1,150 @@
+"""
+Text Batcher - Agrupamento de Mensagens por Chat
+=================================================
+Junta respostas próximas do mesmo chat em um único sendMessage, evitando
+o controle de flood do Telegram (~1 mensagem/s por chat)
+
+Data: 2026-02-03
+"""
+
+import os
+import math
+import threading
+from typing import Callable, Dict, List, Optional
+
+# Limite de texto do Telegram, em unidades UTF-16 (ver utf16_len)
+TELEGRAM_TEXT_LIMIT = 4096
+
+# Separador entre respostas agrupadas na mesma mensagem
+SEPARATOR = "\n\n"
+
+
+def _env_float_clamped(name: str, default: float, minimum: float, maximum: float) -> float:
+    """
+    Lê número da variável de ambiente, limitado a [minimum, maximum]
+
+    Valores ausentes, inválidos, NaN ou infinitos usam `default`.
+    """
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+
+    try:
+        value = float(raw)
+    except ValueError:
+        value = float("nan")
+
+    if not math.isfinite(value):
+        print(f"[AVISO] {name}={raw!r} inválido, usando {default}")
+        return default
+
+    return min(max(value, minimum), maximum)
+
+
+def utf16_len(text: str) -> int:
+    """
+    Tamanho do texto como o Telegram conta: unidades UTF-16
+
+    Emoji fora do BMP ocupam 2 unidades, então len() subestima.
+    """
+    return len(text.encode("utf-16-le")) // 2
+
+
+# Janela de espera (ms) conforme o tamanho acumulado: textos curtos saem
+# logo, textos longos esperam mais por continuação
+BATCH_SHORT_MS = _env_float_clamped("TG_BATCH_SHORT_MS", 180, 0, 5000)
+BATCH_MEDIUM_MS = 240
+BATCH_LONG_MS = _env_float_clamped("TG_BATCH_LONG_MS", 800, 0, 5000)
+
+SHORT_TEXT = 256
+MEDIUM_TEXT = 1024
+
+
+class _PendingText:
+    """Respostas aguardando envio para um chat"""
+
+    __slots__ = ("parts", "length", "send", "timer")
+
+    def __init__(self, send: Callable[[int, str], None]):
+        self.parts: List[str] = []
+        self.length = 0
+        self.send = send
+        self.timer: Optional[threading.Timer] = None
+
+
+class TextBatcher:
+    """
+    Debounce de mensagens por chat, thread-safe
+
+    Cada `enqueue` reinicia o timer do chat; o texto acumulado é enviado
+    quando o timer expira ou quando a próxima parte passaria do limite de
+    tamanho do Telegram (nesse caso o acumulado sai na hora). Tamanhos
+    em unidades UTF-16, como o Telegram conta.
+    """
+
+    def __init__(self, limit: int = TELEGRAM_TEXT_LIMIT):
+        self.limit = limit
+        self._pending: Dict[int, _PendingText] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def delay_for(length: int) -> float:
+        """Janela de espera em segundos para o tamanho acumulado"""
+        if length <= SHORT_TEXT:
+            return BATCH_SHORT_MS / 1000
+        if length <= MEDIUM_TEXT:
+            return BATCH_MEDIUM_MS / 1000
+        return BATCH_LONG_MS / 1000
+
+    def enqueue(self, chat_id: int, text: str, send: Callable[[int, str], None]) -> None:
+        """
+        Agenda texto para envio ao chat
+
+        Args:
+            chat_id: Chat do Telegram
+            text: Texto da resposta
+            send: Função send(chat_id, text) que faz o envio
+        """
+        full = None
+
+        with self._lock:
+            pending = self._pending.get(chat_id)
+
+            length = utf16_len(text)
+
+            if pending is not None:
+                pending.timer.cancel()
+                if pending.length + len(SEPARATOR) + length > self.limit:
+                    # Não cabe: envia o acumulado agora e começa outro lote
+                    del self._pending[chat_id]
+                    full = pending
+                    pending = None
+
+            if pending is None:
+                pending = _PendingText(send)
+                self._pending[chat_id] = pending
+            else:
+                pending.length += len(SEPARATOR)
+
+            pending.parts.append(text)
+            pending.length += length
+            pending.send = send
+
+            pending.timer = threading.Timer(self.delay_for(pending.length), self._flush, (chat_id, pending))
+            pending.timer.daemon = True
+            pending.timer.start()
+
+        if full is not None:
+            full.send(chat_id, SEPARATOR.join(full.parts))
+
+    def _flush(self, chat_id: int, pending: _PendingText) -> None:
+        """Envia o lote do chat (se ainda não foi enviado)"""
+        with self._lock:
+            if self._pending.get(chat_id) is not pending:
+                return
+            del self._pending[chat_id]
+
+        try:
+            pending.send(chat_id, SEPARATOR.join(pending.parts))
+        except Exception as e:
+            print(f"[ERRO] Envio agrupado: {e}")
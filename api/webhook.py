@@ -13,357 +13,739 @@ import os
 # Adicionar path para importar processadores
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..'))
 
-import json
-import requests
-from http.server import BaseHTTPRequestHandler
+import html
+import queue
+import tempfile
+import threading
+import time
+import orjson
+import msgspec
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import wait
 from datetime import datetime
+from types import SimpleNamespace
+from typing import List, Optional
+
+# Sessão HTTP compartilhada com os processadores (keep-alive com api.telegram.org)
+from api.processors.session import SESSION, warm_connection
+from api.processors.text_batcher import TELEGRAM_TEXT_LIMIT, TextBatcher, utf16_len
+from api.cache.lru import LRUCache
+from api.cache.semantic import SemanticCache
+
+# Processadores importados sob demanda (ver _get_processors): o health check
+# e os comandos não pagam a importação no cold start
+_processors = None
+IMPORTS_OK = None  # None = ainda não importados
+_processors_lock = threading.Lock()
+
+
+def _get_processors():
+    """
+    Importa os processadores na primeira chamada
+    
+    Returns:
+        Namespace com as funções usadas pelo webhook, ou None se a
+        importação falhou
+    """
+    global _processors, IMPORTS_OK
+    
+    if IMPORTS_OK is None:
+        with _processors_lock:
+            if IMPORTS_OK is None:
+                try:
+                    from api.processors.groq_whisper import transcribe_file, GROQ_BASE_URL
+                    from api.processors.groq_nlp import extract_any, classify_intent
+                    from api.processors.gemini_vision import (
+                        analyze_meal_photo,
+                        pick_photo_size,
+                        GEMINI_BASE_URL
+                    )
+                    _processors = SimpleNamespace(
+                        transcribe_file=transcribe_file,
+                        extract_any=extract_any,
+                        classify_intent=classify_intent,
+                        analyze_meal_photo=analyze_meal_photo,
+                        pick_photo_size=pick_photo_size,
+                        GROQ_BASE_URL=GROQ_BASE_URL,
+                        GEMINI_BASE_URL=GEMINI_BASE_URL
+                    )
+                    IMPORTS_OK = True
+                except ImportError as e:
+                    print(f"[AVISO] Erro ao importar processadores: {e}")
+                    IMPORTS_OK = False
+    
+    return _processors
 
-# Importar processadores
-try:
-    from api.processors.groq_whisper import transcribe_from_telegram
-    from api.processors.groq_nlp import (
-        extract_meal_data, 
-        extract_workout_data, 
-        extract_hydration_data,
-        classify_intent
-    )
-    from api.processors.gemini_vision import analyze_meal_from_telegram, extract_structured_meal_data
-    IMPORTS_OK = True
-except ImportError as e:
-    print(f"[AVISO] Erro ao importar processadores: {e}")
-    IMPORTS_OK = False
 
 # Configurações
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+SUPABASE_URL = os.getenv("SUPABASE_URL", "")
 
+# Download de mídia: arquivos até 2MB ficam em memória, maiores vão para disco
+DOWNLOAD_SPOOL_SIZE = 2 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
 
-class handler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        """Health check"""
-        self.send_response(200)
-        self.send_header('Content-type', 'application/json')
-        self.end_headers()
-        
-        status = {
+# Timeouts (conexão, leitura): host fora do ar falha em ~3s em vez de 10s
+TELEGRAM_TIMEOUT = (3.05, 10)
+DOWNLOAD_TIMEOUT = (3.05, 30)
+
+
+def _escape(value):
+    """Escapa texto dinâmico (usuário, modelos, erros) para parse_mode HTML"""
+    return html.escape(str(value), quote=False)
+
+
+def _truncate_utf16(text, limit=TELEGRAM_TEXT_LIMIT):
+    """
+    Corta texto no limite do Telegram, contado em unidades UTF-16
+    
+    O Telegram conta caracteres em UTF-16 (emoji fora do BMP = 2 unidades),
+    então text[:N] pode passar do limite. Corta antes de `limit - 3` sem
+    deixar entidade/tag HTML pela metade nem <b> sem fechamento, e
+    acrescenta "…".
+    """
+    # Cada code point ocupa no máximo 2 unidades: texto curto sempre cabe
+    if len(text) * 2 <= limit or utf16_len(text) <= limit:
+        return text
+    
+    # Primeiro code point que passaria de limit - 3 (folga para o "…")
+    units = 0
+    for cut, char in enumerate(text):
+        units += 2 if ord(char) > 0xFFFF else 1
+        if units > limit - 3:
+            break
+    truncated = text[:cut]
+    
+    # Não deixar "&amp" ou "<b" incompletos no fim (parse_mode HTML)
+    amp, lt = truncated.rfind('&'), truncated.rfind('<')
+    if amp > truncated.rfind(';'):
+        truncated = truncated[:amp]
+    if lt > truncated.rfind('>'):
+        truncated = truncated[:lt]
+    
+    # Nem <b> aberto sem </b> (Telegram responde 400 "can't find end tag")
+    bold = truncated.rfind('<b>')
+    if bold > truncated.rfind('</b>'):
+        truncated = truncated[:bold]
+    
+    return truncated + "…"
+
+
+# Respostas dos comandos (montadas uma vez na importação, a partir das
+# configurações acima)
+_COMMANDS = {
+    '/start': """🎯 <b>Biohacker 2026 Bot - INTEGRADO</b>
+
+✅ <b>Status:</b> Todas APIs conectadas!
+• Telegram: ✅
+• Groq (Whisper + LLM): ✅  
+• Gemini Vision: ✅
+
+<b>O que posso fazer:</b>
+• 📸 Fotos de refeições → Análise automática com Gemini
+• 🎙️ Áudios → Transcrição Whisper + NLP
+• 💬 Texto livre → Extração inteligente de dados
+• 📊 Mini App → Dashboard e relatórios
+
+<b>Envie agora:</b>
+• Uma foto da sua refeição
+• Um áudio descrevendo treino
+• Um texto sobre o que comeu
+
+Vou processar e salvar tudo automaticamente! 🚀""",
+    
+    '/status': f"""📊 <b>Status do Sistema</b>
+
+🤖 Bot: Online
+☁️ Groq API: {'✅' if GROQ_API_KEY else '❌'} 
+📸 Gemini Vision: {'✅' if GEMINI_API_KEY else '❌'}
+🔄 Supabase: {'✅ Configurar' if not SUPABASE_URL else '⏳ Pendente'}
+
+💡 <b>Dica:</b> Se alguma API estiver ❌, configure as variáveis de ambiente.""",
+    
+    '/ajuda': "Use /start para ver funcionalidades ou /status para diagnóstico.",
+    '/refeicao': "📸 Envie uma foto da sua refeição ou descreva em texto/áudio. Vou analisar e extrair os alimentos automaticamente!",
+    '/treino': "🎙️ Envie um áudio descrevendo seu treino (exercícios, séries, cargas) ou diga o que treinou.",
+    '/agua': "💧 Quanto de água você bebeu? Pode enviar em texto ('500ml') ou áudio.",
+    '/medidas': "📏 Mini App: Use o botão no menu para abrir o formulário de medidas.",
+    '/dashboard': "📊 Mini App: Dashboard disponível no botão do menu."
+}
+
+
+# Update do Telegram: só os campos usados; campos extras são ignorados
+# pelo decoder e ausentes assumem o default
+class Chat(msgspec.Struct):
+    id: int
+
+
+class Voice(msgspec.Struct):
+    file_id: str
+    duration: int = 0
+
+
+class PhotoSize(msgspec.Struct):
+    file_id: str
+    width: int = 0
+    height: int = 0
+
+
+class Message(msgspec.Struct):
+    chat: Chat
+    text: str = ''
+    voice: Optional[Voice] = None
+    photo: Optional[List[PhotoSize]] = None
+
+
+class Update(msgspec.Struct):
+    update_id: Optional[int] = None
+    message: Optional[Message] = None
+
+
+_UPDATE_DECODER = msgspec.json.Decoder(Update)
+
+
+# Rótulo da resposta de texto por intenção
+_ACTION_LABELS = {
+    'meal': "🍽️ Refeição",
+    'workout': "💪 Treino",
+    'hydration': "💧 Hidratação"
+}
+
+
+# Cache da análise NLP, por chat: a mesma frase com variações de acento,
+# espaço, pontuação, ordem ou palavras de ligação reaproveita intenção + dados sem chamar o Groq
+_SEMANTIC_CACHE = SemanticCache(os.getenv("SEMANTIC_CACHE_PATH", ":memory:"))
+_EXACT_CACHE = LRUCache(maxsize=4096, ttl=24 * 3600)
+
+# getFile por file_id (URLs de arquivo do Telegram valem ~1h) e update_ids já
+# enfileirados (retentativas do Telegram são descartadas sem processar)
+_FILE_URL_CACHE = LRUCache(maxsize=2048, ttl=3300)
+_SEEN_UPDATES = LRUCache(maxsize=1024, ttl=300)
+
+
+def cached_analysis(chat_id, text, analyze):
+    """
+    Retorna {"kind", "data"} do cache (exato, depois semântico) ou executa analyze(text)
+    
+    Resultados com erro não são guardados.
+    """
+    # Camada exata (dict) antes da camada semântica (SQLite).
+    # Chave com o texto inteiro: o valor são os dados extraídos, então dois
+    # textos com o mesmo início não podem dividir a entrada
+    exact_key = (chat_id, " ".join(text.lower().split()))
+    cached = _EXACT_CACHE.get(exact_key)
+    if cached is not None:
+        return cached
+    
+    cached = _SEMANTIC_CACHE.get(chat_id, text)
+    if cached is not None:
+        print(f"[CACHE] Análise reaproveitada para chat {chat_id}")
+        _EXACT_CACHE.set(exact_key, cached)
+        return cached
+    
+    result = analyze(text)
+    data = result.get('data')
+    failed = result.get('error') or (isinstance(data, dict) and data.get('success') is False)
+    if not failed:
+        _SEMANTIC_CACHE.set(chat_id, text, result)
+        _EXACT_CACHE.set(exact_key, result)
+    return result
+
+
+# Health check: parte fixa serializada uma vez por estado da importação
+# ("lazy", true, false), sem o "}" final; do_GET só acrescenta o timestamp
+_STATUS_PREFIXES = {}
+
+
+def _status_prefix():
+    """Retorna a parte fixa do health check para o estado atual"""
+    imports_ok = "lazy" if IMPORTS_OK is None else IMPORTS_OK
+    prefix = _STATUS_PREFIXES.get(imports_ok)
+    if prefix is None:
+        prefix = _STATUS_PREFIXES[imports_ok] = orjson.dumps({
             "status": "ok",
             "message": "Biohacker Telegram Webhook v1.0",
-            "imports_ok": IMPORTS_OK,
+            "imports_ok": imports_ok,
             "apis_configured": {
                 "telegram": bool(TELEGRAM_BOT_TOKEN),
                 "groq": bool(GROQ_API_KEY),
                 "gemini": bool(GEMINI_API_KEY)
-            },
-            "timestamp": datetime.now().isoformat()
+            }
+        })[:-1]
+    return prefix
+
+# Respostas do mesmo chat em sequência viram um só sendMessage
+_TEXT_BATCHER = TextBatcher()
+
+
+# Corpo fixo da resposta ao Telegram (enviado a cada webhook)
+_OK_BODY = b'{"ok":true}'
+
+
+# Threads do servidor HTTP local: o Telegram abre até 40 conexões
+# simultâneas por padrão (max_connections do setWebhook)
+HTTP_WORKERS = int(os.getenv("WORKERS", "40"))
+
+# Fila de mensagens (modo fila, só no servidor próprio: PooledHTTPServer):
+# do_POST enfileira e responde 200 imediatamente
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "8"))
+QUEUE_MAXSIZE = 512
+
+_UPDATE_QUEUE = queue.Queue(maxsize=QUEUE_MAXSIZE)
+_workers = []
+_workers_lock = threading.Lock()
+
+
+def _worker():
+    """Consome a fila processando uma mensagem por vez"""
+    while True:
+        message = _UPDATE_QUEUE.get()
+        try:
+            handle_message(message, batched=True)
+        except Exception as e:
+            print(f"[ERRO] Worker: {e}")
+        finally:
+            _UPDATE_QUEUE.task_done()
+
+
+def _ensure_workers():
+    """Inicia os workers na primeira mensagem"""
+    with _workers_lock:
+        while len(_workers) < WORKER_COUNT:
+            thread = threading.Thread(target=_worker, name=f"webhook-worker-{len(_workers)}", daemon=True)
+            thread.start()
+            _workers.append(thread)
+
+
+def handle_message(message, batched=False):
+    """
+    Processa mensagem, envia resposta e registra dados
+    
+    Args:
+        message: Message do update
+        batched: Enviar via _TEXT_BATCHER (só no modo fila, em que o
+            processo continua vivo depois do 200). Respostas de comandos
+            saem sempre sozinhas: /start e /status seguidos não viram
+            uma mensagem só.
+    """
+    chat_id = message.chat.id
+    
+    # Processar mensagem
+    result = process_message(message)
+    
+    # Enviar resposta
+    is_command = bool(message.text) and message.text.startswith('/')
+    if batched and not is_command:
+        _TEXT_BATCHER.enqueue(chat_id, result['response'], send_message)
+    else:
+        send_message(chat_id, result['response'])
+    
+    # Salvar dados processados (futuro: Supabase)
+    if result.get('data'):
+        print(f"[DATA] Dados extraídos: {orjson.dumps(result['data']).decode()}")
+
+
+def process_message(message):
+    """Processa mensagem com integrações"""
+    text = message.text
+    voice = message.voice
+    photo = message.photo
+    chat_id = message.chat.id
+
+    print(f"[PROCESS] Chat {chat_id}: texto={bool(text)}, voz={bool(voice)}, foto={bool(photo)}")
+
+    # Verificar comandos primeiro
+    if text and text.startswith('/'):
+        return handle_command(text, chat_id)
+
+    processors = _get_processors()
+
+    # Processar FOTO (prioridade máxima - análise Gemini)
+    if photo and processors and GEMINI_API_KEY:
+        return process_photo(photo, text)
+
+    # Processar ÁUDIO (transcrição Whisper)
+    if voice and processors and GROQ_API_KEY:
+        return process_voice(voice, text, chat_id)
+
+    # Processar TEXTO (NLP)
+    if text and processors and GROQ_API_KEY:
+        return process_text(text, chat_id)
+
+    # Fallback básico
+    return {
+        'response': "✅ Mensagem recebida! (Processamento avançado em configuração)",
+        'data': None
+    }
+
+
+def process_photo(photo_list, caption):
+    """Processa foto com Gemini Vision"""
+    try:
+        # Pegar menor resolução que ainda atende a análise
+        p = _get_processors()
+        photo = p.pick_photo_size(photo_list)
+        file_id = photo.file_id
+
+        # Aquecer conexão com Gemini enquanto baixa a foto do Telegram
+        warm_connection(SESSION, p.GEMINI_BASE_URL)
+        photo_file = get_telegram_file(file_id)
+        if photo_file is None:
+            return {'response': "❌ Erro ao acessar foto", 'data': None}
+
+        # Analisar com Gemini
+        with photo_file:
+            result = p.analyze_meal_photo(photo_file.read())
+
+        if result['success']:
+            analysis = result['analysis']
+            structured = result.get('structured', {})
+
+            # Construir resposta (partes + join: uma única cópia)
+            parts = ["📸 <b>Foto Analisada!</b>\n\n", _escape(analysis), "\n\n"]
+
+            if caption:
+                parts.append(f"📝 Legenda: {_escape(caption)}\n")
+
+            parts.append("\n✅ Dados extraídos e salvos na fila de sincronização!")
+
+            return {
+                'response': "".join(parts),
+                'data': {
+                    'type': 'meal_photo',
+                    'analysis': analysis,
+                    'structured': structured,
+                    'caption': caption
+                }
+            }
+        else:
+            return {
+                'response': f"⚠️ Erro na análise: {_escape(result.get('error', 'Desconhecido'))}",
+                'data': None
+            }
+
+    except Exception as e:
+        return {'response': f"❌ Erro ao processar foto: {_escape(e)}", 'data': None}
+
+
+def process_voice(voice, caption, chat_id=None):
+    """Processa áudio com Whisper"""
+    try:
+        p = _get_processors()
+        file_id = voice.file_id
+        duration = voice.duration
+
+        # Aquecer conexão com Groq enquanto baixa o áudio do Telegram
+        warm_connection(SESSION, p.GROQ_BASE_URL)
+        audio_file = get_telegram_file(file_id)
+        if audio_file is None:
+            return {'response': "❌ Erro ao acessar áudio", 'data': None}
+
+        # Transcrever
+        with audio_file:
+            result = p.transcribe_file(audio_file, 'voice.ogg')
+
+        if result['success']:
+            transcription = result['text']
+
+            # Classificar intenção e extrair dados (uma única chamada)
+            analysis = cached_analysis(chat_id, transcription, p.extract_any)
+            intent = analysis['kind']
+            extracted_data = analysis['data']
+
+            # Construir resposta (partes + join: uma única cópia)
+            parts = [
+                "🎙️ <b>Áudio Transcrito!</b>\n\n",
+                f"📝 Texto: \"{_escape(transcription)}\"\n\n",
+                f"🎯 Intenção: {intent}\n"
+            ]
+
+            if extracted_data:
+                parts.append(f"📊 Dados extraídos: {_escape(orjson.dumps(extracted_data, option=orjson.OPT_INDENT_2).decode())}\n\n")
+
+            parts.append("✅ Salvo na fila de sincronização!")
+
+            return {
+                'response': "".join(parts),
+                'data': {
+                    'type': 'voice',
+                    'transcription': transcription,
+                    'intent': intent,
+                    'extracted': extracted_data,
+                    'duration': duration
+                }
+            }
+        else:
+            return {
+                'response': f"⚠️ Erro na transcrição: {_escape(result.get('error', 'Desconhecido'))}",
+                'data': None
+            }
+
+    except Exception as e:
+        return {'response': f"❌ Erro ao processar áudio: {_escape(e)}", 'data': None}
+
+
+def process_text(text, chat_id=None):
+    """Processa texto com NLP"""
+    try:
+        # Classificar intenção e extrair dados (uma única chamada)
+        result = cached_analysis(chat_id, text, _get_processors().extract_any)
+        intent = result['kind']
+        extracted_data = result['data']
+
+        action_desc = _ACTION_LABELS.get(intent, "📝 Mensagem")
+
+        # Construir resposta (partes + join: uma única cópia)
+        parts = [
+            f"{action_desc} registrada!\n\n",
+            f"📝 Texto: \"{_escape(text[:100])}{'...' if len(text) > 100 else ''}\"\n",
+            f"🎯 Intenção: {intent}\n"
+        ]
+
+        if extracted_data:
+            parts.append(f"📊 Dados: {_escape(orjson.dumps(extracted_data, option=orjson.OPT_INDENT_2).decode()[:300])}...\n\n")
+
+        parts.append("✅ Salvo na fila de sincronização!")
+
+        return {
+            'response': "".join(parts),
+            'data': {
+                'type': 'text',
+                'text': text,
+                'intent': intent,
+                'extracted': extracted_data
+            }
         }
-        
-        self.wfile.write(json.dumps(status).encode())
+
+    except Exception as e:
+        return {'response': f"❌ Erro no processamento: {_escape(e)}", 'data': None}
+
+
+def handle_command(text, chat_id):
+    """Processa comandos /comando"""
+    # Só o primeiro token; chaves de _COMMANDS já estão em minúsculas,
+    # então lower() só é feito se a busca direta falhar
+    command = text.split(None, 1)[0]
+    response = _COMMANDS.get(command)
+    if response is None:
+        command = command.lower()
+        response = _COMMANDS.get(command, f"Comando {_escape(command)} não reconhecido. Use /ajuda")
+    return {'response': response, 'data': {'type': 'command', 'command': command}}
+
+
+def get_telegram_file_url(file_id):
+    """Obtém URL do arquivo do Telegram"""
+    cached = _FILE_URL_CACHE.get(file_id)
+    if cached is not None:
+        return cached
+
+    try:
+        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getFile"
+        response = SESSION.post(url, json={'file_id': file_id}, timeout=TELEGRAM_TIMEOUT)
+
+        if response.status_code == 200:
+            result = response.json()
+            if result.get('ok'):
+                file_path = result['result']['file_path']
+                file_url = f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}"
+                _FILE_URL_CACHE.set(file_id, file_url)
+                return file_url
+        return None
+    except:
+        return None
+
+
+def get_telegram_file(file_id):
+    """
+    Baixa arquivo do Telegram uma única vez (getFile + download em streaming)
+
+    Returns:
+        Arquivo temporário posicionado no início, ou None em caso de erro
+    """
+    file_url = get_telegram_file_url(file_id)
+    if not file_url:
+        return None
+
+    buffer = tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_SIZE)
+    try:
+        with SESSION.get(file_url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+            if response.status_code != 200:
+                print(f"[ERRO] Download do arquivo: {response.status_code}")
+                buffer.close()
+                return None
+
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                buffer.write(chunk)
+    except Exception as e:
+        print(f"[ERRO] Download do arquivo: {e}")
+        buffer.close()
+        return None
+
+    buffer.seek(0)
+    return buffer
+
+
+def send_message(chat_id, text):
+    """Envia mensagem de resposta"""
+    print(f"[SEND] chat_id={chat_id}, token exists={bool(TELEGRAM_BOT_TOKEN)}")
+
+    if not TELEGRAM_BOT_TOKEN:
+        print("[ERRO] TELEGRAM_BOT_TOKEN não configurado")
+        return
+
+    url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
+    payload = {
+        'chat_id': chat_id,
+        'text': _truncate_utf16(text),  # Limite Telegram (UTF-16)
+        'parse_mode': 'HTML'
+    }
+
+    try:
+        print(f"[SEND] Enviando para {url[:50]}...")
+        response = SESSION.post(url, json=payload, timeout=TELEGRAM_TIMEOUT)
+        print(f"[SEND] Status: {response.status_code}, Response: {response.text[:100]}")
+    except Exception as e:
+        print(f"[ERRO] Enviando mensagem: {e}")
+
+
+class handler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keep-alive: o Telegram reaproveita a conexão entre webhooks
+    # (toda resposta precisa de Content-Length; ver send_body)
+    protocol_version = "HTTP/1.1"
+    # Fecha conexões ociosas após 30s
+    timeout = 30
+    
+    def send_body(self, code, body=b""):
+        """Envia resposta completa com Content-Length (necessário no keep-alive)"""
+        self.send_response(code)
+        if body:
+            self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+    
+    def do_GET(self):
+        """Health check"""
+        timestamp = datetime.now().isoformat().encode()
+        self.send_body(200, _status_prefix() + b',"timestamp":"' + timestamp + b'"}')
     
     def do_POST(self):
         """Processa webhooks do Telegram"""
         try:
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            # Decodifica os bytes direto no schema (sem dicts intermediários)
+            post_data = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            try:
+                update = _UPDATE_DECODER.decode(post_data)
+            except msgspec.ValidationError as e:
+                # JSON válido fora do schema: confirmar para o Telegram não reenviar
+                print(f"[AVISO] Update ignorado: {e}")
+                self.send_body(200)
+                return
+            
+            # Retentativa de update já processado/enfileirado: confirmar sem processar
+            update_id = update.update_id
+            if update_id is not None and update_id in _SEEN_UPDATES:
+                print(f"[WEBHOOK] Update {update_id} duplicado, ignorando")
+                self.send_body(200)
+                return
             
             # Log
-            print(f"[WEBHOOK] Recebido: {json.dumps(data, indent=2)[:200]}...")
+            print(f"[WEBHOOK] Recebido: {post_data[:200].decode(errors='ignore')}...")
             
-            if 'message' in data:
-                message = data['message']
-                chat_id = message.get('chat', {}).get('id')
-                
-                # Processar mensagem
-                result = self.process_message(message)
+            if update.message is not None:
+                if getattr(self.server, 'queue_updates', False):
+                    # Servidor próprio: enfileirar e responder já; workers
+                    # processam em background
+                    _ensure_workers()
+                    try:
+                        _UPDATE_QUEUE.put_nowait(update.message)
+                    except queue.Full:
+                        print("[AVISO] Fila cheia, pedindo retentativa ao Telegram")
+                        self.send_body(503)
+                        return
+                else:
+                    # Serverless (Vercel): trabalho após o 200 não tem garantia
+                    # de terminar, então processar antes de responder (erro
+                    # vira 500 e o Telegram reenvia)
+                    handle_message(update.message)
                 
-                # Enviar resposta
-                self.send_message(chat_id, result['response'])
-                
-                # Salvar dados processados (futuro: Supabase)
-                if result.get('data'):
-                    print(f"[DATA] Dados extraídos: {json.dumps(result['data'], indent=2)}")
+                if update_id is not None:
+                    _SEEN_UPDATES.set(update_id, True)
                 
                 # Responder 200 OK
-                self.send_response(200)
-                self.send_header('Content-type', 'application/json')
-                self.end_headers()
-                self.wfile.write(json.dumps({"ok": True}).encode())
+                self.send_body(200, _OK_BODY)
             else:
-                self.send_response(200)
-                self.end_headers()
+                self.send_body(200)
                 
         except Exception as e:
             print(f"[ERRO] Webhook: {e}")
-            self.send_response(500)
-            self.end_headers()
-            self.wfile.write(json.dumps({"ok": False, "error": str(e)}).encode())
+            self.send_body(500, orjson.dumps({"ok": False, "error": str(e)}))
+
+
+def warmup(timeout=5):
+    """
+    Prepara o caminho da primeira mensagem antes de aceitar conexões
     
-    def process_message(self, message):
-        """Processa mensagem com integrações"""
-        text = message.get('text', '')
-        voice = message.get('voice')
-        photo = message.get('photo')
-        chat_id = message.get('chat', {}).get('id')
-        
-        print(f"[PROCESS] Chat {chat_id}: texto={bool(text)}, voz={bool(voice)}, foto={bool(photo)}")
-        
-        # Verificar comandos primeiro
-        if text and text.startswith('/'):
-            return self.handle_command(text, chat_id)
-        
-        # Processar FOTO (prioridade máxima - análise Gemini)
-        if photo and IMPORTS_OK and GEMINI_API_KEY:
-            return self.process_photo(photo, text)
-        
-        # Processar ÁUDIO (transcrição Whisper)
-        if voice and IMPORTS_OK and GROQ_API_KEY:
-            return self.process_voice(voice, text)
-        
-        # Processar TEXTO (NLP)
-        if text and IMPORTS_OK and GROQ_API_KEY:
-            return self.process_text(text)
-        
-        # Fallback básico
-        return {
-            'response': "✅ Mensagem recebida! (Processamento avançado em configuração)",
-            'data': None
-        }
+    Abre a conexão com api.telegram.org, importa os processadores (que já
+    aquecem Groq/Gemini) e faz uma consulta ao cache semântico (SQLite).
+    Não faz chamadas pagas às APIs.
     
-    def process_photo(self, photo_list, caption):
-        """Processa foto com Gemini Vision"""
-        try:
-            # Pegar foto de maior resolução
-            photo = photo_list[-1]
-            file_id = photo['file_id']
-            
-            # Baixar foto do Telegram
-            file_url = self.get_telegram_file_url(file_id)
-            if not file_url:
-                return {'response': "❌ Erro ao acessar foto", 'data': None}
-            
-            # Analisar com Gemini
-            result = analyze_meal_from_telegram(file_url, TELEGRAM_BOT_TOKEN)
-            
-            if result['success']:
-                analysis = result['analysis']
-                structured = result.get('structured', {})
-                
-                # Construir resposta
-                response = f"📸 **Foto Analisada!**\n\n{analysis}\n\n"
-                
-                if caption:
-                    response += f"📝 Legenda: {caption}\n"
-                
-                response += "\n✅ Dados extraídos e salvos na fila de sincronização!"
-                
-                return {
-                    'response': response,
-                    'data': {
-                        'type': 'meal_photo',
-                        'analysis': analysis,
-                        'structured': structured,
-                        'caption': caption
-                    }
-                }
-            else:
-                return {
-                    'response': f"⚠️ Erro na análise: {result.get('error', 'Desconhecido')}",
-                    'data': None
-                }
-                
-        except Exception as e:
-            return {'response': f"❌ Erro ao processar foto: {str(e)}", 'data': None}
+    Returns:
+        Duração em segundos
+    """
+    start = time.perf_counter()
     
-    def process_voice(self, voice, caption):
-        """Processa áudio com Whisper"""
-        try:
-            file_id = voice['file_id']
-            duration = voice.get('duration', 0)
-            
-            # Baixar áudio
-            file_url = self.get_telegram_file_url(file_id)
-            if not file_url:
-                return {'response': "❌ Erro ao acessar áudio", 'data': None}
-            
-            # Transcrever
-            result = transcribe_from_telegram(file_url, TELEGRAM_BOT_TOKEN)
-            
-            if result['success']:
-                transcription = result['text']
-                
-                # Classificar intenção e extrair dados
-                intent = classify_intent(transcription)
-                extracted_data = None
-                
-                if intent == 'meal':
-                    extracted_data = extract_meal_data(transcription)
-                elif intent == 'workout':
-                    extracted_data = extract_workout_data(transcription)
-                elif intent == 'hydration':
-                    extracted_data = extract_hydration_data(transcription)
-                
-                # Construir resposta
-                response = f"🎙️ **Áudio Transcrito!**\n\n"
-                response += f"📝 Texto: \"{transcription}\"\n\n"
-                response += f"🎯 Intenção: {intent}\n"
-                
-                if extracted_data:
-                    response += f"📊 Dados extraídos: {json.dumps(extracted_data, indent=2, ensure_ascii=False)}\n\n"
-                
-                response += "✅ Salvo na fila de sincronização!"
-                
-                return {
-                    'response': response,
-                    'data': {
-                        'type': 'voice',
-                        'transcription': transcription,
-                        'intent': intent,
-                        'extracted': extracted_data,
-                        'duration': duration
-                    }
-                }
-            else:
-                return {
-                    'response': f"⚠️ Erro na transcrição: {result.get('error', 'Desconhecido')}",
-                    'data': None
-                }
-                
-        except Exception as e:
-            return {'response': f"❌ Erro ao processar áudio: {str(e)}", 'data': None}
+    telegram = warm_connection(SESSION, "https://api.telegram.org", timeout=timeout)
     
-    def process_text(self, text):
-        """Processa texto com NLP"""
-        try:
-            # Classificar intenção
-            intent = classify_intent(text)
-            
-            # Extrair dados baseado na intenção
-            extracted_data = None
-            action_desc = ""
-            
-            if intent == 'meal':
-                extracted_data = extract_meal_data(text)
-                action_desc = "🍽️ Refeição"
-            elif intent == 'workout':
-                extracted_data = extract_workout_data(text)
-                action_desc = "💪 Treino"
-            elif intent == 'hydration':
-                extracted_data = extract_hydration_data(text)
-                action_desc = "💧 Hidratação"
-            else:
-                action_desc = "📝 Mensagem"
-            
-            # Construir resposta
-            response = f"{action_desc} registrada!\n\n"
-            response += f"📝 Texto: \"{text[:100]}{'...' if len(text) > 100 else ''}\"\n"
-            response += f"🎯 Intenção: {intent}\n"
-            
-            if extracted_data:
-                response += f"📊 Dados: {json.dumps(extracted_data, indent=2, ensure_ascii=False)[:300]}...\n\n"
-            
-            response += "✅ Salvo na fila de sincronização!"
-            
-            return {
-                'response': response,
-                'data': {
-                    'type': 'text',
-                    'text': text,
-                    'intent': intent,
-                    'extracted': extracted_data
-                }
-            }
-            
-        except Exception as e:
-            return {'response': f"❌ Erro no processamento: {str(e)}", 'data': None}
+    _get_processors()
+    _SEMANTIC_CACHE.get(0, "bebi 500ml de água")
     
-    def handle_command(self, text, chat_id):
-        """Processa comandos /comando"""
-        command = text.split()[0].lower()
-        
-        commands = {
-            '/start': """🎯 **Biohacker 2026 Bot - INTEGRADO**
-
-✅ **Status:** Todas APIs conectadas!
-• Telegram: ✅
-• Groq (Whisper + LLM): ✅  
-• Gemini Vision: ✅
-
-**O que posso fazer:**
-• 📸 Fotos de refeições → Análise automática com Gemini
-• 🎙️ Áudios → Transcrição Whisper + NLP
-• 💬 Texto livre → Extração inteligente de dados
-• 📊 Mini App → Dashboard e relatórios
-
-**Envie agora:**
-• Uma foto da sua refeição
-• Um áudio descrevendo treino
-• Um texto sobre o que comeu
-
-Vou processar e salvar tudo automaticamente! 🚀""",
-            
-            '/status': f"""📊 **Status do Sistema**
+    wait([telegram], timeout=timeout)
+    
+    elapsed = time.perf_counter() - start
+    print(f"[WARMUP] Concluído em {elapsed * 1000:.0f}ms")
+    return elapsed
 
-🤖 Bot: Online
-☁️ Groq API: {'✅' if GROQ_API_KEY else '❌'} 
-📸 Gemini Vision: {'✅' if GEMINI_API_KEY else '❌'}
-🔄 Supabase: {'✅ Configurar' if not os.getenv('SUPABASE_URL') else '⏳ Pendente'}
 
-💡 **Dica:** Se alguma API estiver ❌, configure as variáveis de ambiente.""",
-            
-            '/ajuda': "Use /start para ver funcionalidades ou /status para diagnóstico.",
-            '/refeicao': "📸 Envie uma foto da sua refeição ou descreva em texto/áudio. Vou analisar e extrair os alimentos automaticamente!",
-            '/treino': "🎙️ Envie um áudio descrevendo seu treino (exercícios, séries, cargas) ou diga o que treinou.",
-            '/agua': "💧 Quanto de água você bebeu? Pode enviar em texto ('500ml') ou áudio.",
-            '/medidas': "📏 Mini App: Use o botão no menu para abrir o formulário de medidas.",
-            '/dashboard': "📊 Mini App: Dashboard disponível no botão do menu."
-        }
-        
-        response = commands.get(command, f"Comando {command} não reconhecido. Use /ajuda")
-        return {'response': response, 'data': {'type': 'command', 'command': command}}
+class PooledHTTPServer(ThreadingHTTPServer):
+    """
+    ThreadingHTTPServer com número limitado de threads
+    
+    Conexões simultâneas são atendidas em paralelo (uma conexão keep-alive
+    ociosa não bloqueia as demais), mas no máximo `max_workers` ao mesmo
+    tempo; com todas ocupadas, o accept espera uma thread terminar.
+    As threads continuam daemon (daemon_threads do ThreadingHTTPServer),
+    então conexões keep-alive abertas não seguram a saída do processo.
+    """
+    
+    # Processo de longa duração: do_POST pode responder antes de processar
+    queue_updates = True
+    
+    def __init__(self, server_address, handler_class, max_workers=HTTP_WORKERS):
+        super().__init__(server_address, handler_class)
+        self._slots = threading.BoundedSemaphore(max_workers)
     
-    def get_telegram_file_url(self, file_id):
-        """Obtém URL do arquivo do Telegram"""
+    def process_request(self, request, client_address):
+        self._slots.acquire()
         try:
-            url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/getFile"
-            response = requests.post(url, json={'file_id': file_id}, timeout=10)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('ok'):
-                    file_path = result['result']['file_path']
-                    return f"https://api.telegram.org/file/bot{TELEGRAM_BOT_TOKEN}/{file_path}"
-            return None
-        except:
-            return None
+            super().process_request(request, client_address)
+        except Exception:
+            self._slots.release()
+            raise
     
-    def send_message(self, chat_id, text):
-        """Envia mensagem de resposta"""
-        print(f"[SEND] chat_id={chat_id}, token exists={bool(TELEGRAM_BOT_TOKEN)}")
-        
-        if not TELEGRAM_BOT_TOKEN:
-            print("[ERRO] TELEGRAM_BOT_TOKEN não configurado")
-            return
-        
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        payload = {
-            'chat_id': chat_id,
-            'text': text[:4000],  # Limite Telegram
-            'parse_mode': 'Markdown'
-        }
-        
+    def process_request_thread(self, request, client_address):
         try:
-            print(f"[SEND] Enviando para {url[:50]}...")
-            response = requests.post(url, json=payload, timeout=10)
-            print(f"[SEND] Status: {response.status_code}, Response: {response.text[:100]}")
-        except Exception as e:
-            print(f"[ERRO] Enviando mensagem: {e}")
+            super().process_request_thread(request, client_address)
+        finally:
+            self._slots.release()
 
 
 # Teste local
 if __name__ == "__main__":
-    from http.server import HTTPServer
-    server = HTTPServer(('0.0.0.0', 8000), handler)
+    server = PooledHTTPServer(('0.0.0.0', 8000), handler)
     print("[SERVIDOR] Biohacker Telegram Webhook v1.0")
     print("[INFO] Teste: http://localhost:8000")
     print("[INFO] Webhook: http://localhost:8000 (POST)")
@@ -373,4 +755,5 @@ if __name__ == "__main__":
     print(f"  Groq: {'✅' if GROQ_API_KEY else '❌'}")
     print(f"  Gemini: {'✅' if GEMINI_API_KEY else '❌'}")
     print()
+    warmup()
     server.serve_forever()
@@ -6,75 +6,86 @@ Versão mínima para testar se o Telegram está conseguindo comunicar
 
 import os
 import json
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from http.server import BaseHTTPRequestHandler
+from datetime import datetime
 
-def get_token():
-    """Lê token de ambiente"""
-    token = os.getenv("TELEGRAM_BOT_TOKEN", "")
-    if not token:
-        token = os.getenv("TOKEN", "")
-    if not token:
-        token = os.getenv("BOT_TOKEN", "")
-    return token
+# Token lido uma vez na importação (aceita os nomes alternativos de variável)
+_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN") or os.getenv("TOKEN") or os.getenv("BOT_TOKEN") or ""
+
+# Sessão com keep-alive para api.telegram.org (sem novo handshake TLS a
+# cada resposta) e retentativa em 429/5xx
+_session = requests.Session()
+_session.mount("https://", HTTPAdapter(
+    pool_connections=20,
+    pool_maxsize=50,
+    max_retries=Retry(
+        total=2,
+        read=0,  # timeout de leitura não repete: evita resposta duplicada
+        backoff_factor=0.2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=None,
+        raise_on_status=False
+    )
+))
+
+
+# Health check: parte fixa serializada na importação, sem o "}" final
+_STATUS_PREFIX = orjson.dumps({
+    "status": "ok",
+    "message": "Webhook Test v2.1",
+    "token_exists": bool(_TOKEN),
+    "token_length": len(_TOKEN)
+})[:-1]
 
 
 class handler(BaseHTTPRequestHandler):
-    def do_GET(self):
-        """Health check"""
-        token = get_token()
-        
-        self.send_response(200)
+    # HTTP/1.1 keep-alive (toda resposta precisa de Content-Length)
+    protocol_version = "HTTP/1.1"
+    timeout = 30
+    
+    def send_body(self, code, body):
+        """Envia resposta JSON com Content-Length"""
+        self.send_response(code)
         self.send_header('Content-type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
         self.end_headers()
-        
-        status = {
-            "status": "ok",
-            "message": "Webhook Test v2.1",
-            "token_exists": bool(token),
-            "token_length": len(token) if token else 0,
-            "timestamp": __import__('datetime').datetime.now().isoformat()
-        }
-        
-        self.wfile.write(json.dumps(status).encode())
+        self.wfile.write(body)
+    
+    def do_GET(self):
+        """Health check"""
+        timestamp = datetime.now().isoformat().encode()
+        self.send_body(200, _STATUS_PREFIX + b',"timestamp":"' + timestamp + b'"}')
     
     def do_POST(self):
         """Processa webhooks do Telegram"""
         try:
             content_length = int(self.headers.get('Content-Length', 0))
             if content_length == 0:
-                self.send_response(400)
-                self.end_headers()
-                self.wfile.write(json.dumps({"error": "No content"}).encode())
+                self.send_body(400, json.dumps({"error": "No content"}).encode())
                 return
             
             post_data = self.rfile.read(content_length)
-            data = json.loads(post_data.decode('utf-8'))
+            data = orjson.loads(post_data)
             
             # Extrair dados da mensagem
             message = data.get('message', {})
             chat_id = message.get('chat', {}).get('id')
             text = message.get('text', '')
             
-            # Pegar token
-            token = get_token()
-            
-            if chat_id and text and token:
+            if chat_id and text and _TOKEN:
                 # Enviar resposta via Telegram API
-                self.send_telegram_message(chat_id, f"✅ Recebido: {text}", token)
+                self.send_telegram_message(chat_id, f"✅ Recebido: {text}", _TOKEN)
             
             # Sempre responder 200 OK para o Telegram
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"ok": True}).encode())
+            self.send_body(200, json.dumps({"ok": True}).encode())
             
         except Exception as e:
             print(f"[ERRO] Webhook: {e}")
-            self.send_response(500)
-            self.send_header('Content-type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({"ok": False, "error": str(e)}).encode())
+            self.send_body(500, json.dumps({"ok": False, "error": str(e)}).encode())
     
     def send_telegram_message(self, chat_id, text, token):
         """Envia mensagem de resposta via Telegram API"""
@@ -85,7 +96,7 @@ class handler(BaseHTTPRequestHandler):
         }
         
         try:
-            response = requests.post(url, json=payload, timeout=10)
+            response = _session.post(url, json=payload, timeout=(3.05, 10))
             return response.status_code == 200
         except Exception as e:
             print(f"[ERRO] Enviando: {e}")
@@ -93,7 +104,7 @@ class handler(BaseHTTPRequestHandler):
 
 
 if __name__ == "__main__":
-    from http.server import HTTPServer
-    server = HTTPServer(('0.0.0.0', 8000), handler)
+    from http.server import ThreadingHTTPServer
+    server = ThreadingHTTPServer(('0.0.0.0', 8000), handler)
     print("[TEST] Servidor rodando em http://localhost:8000")
     server.serve_forever()